@@ -0,0 +1,387 @@
+#Async serving mode: the routes of routes.py as coroutines for an ASGI server, e.g. `hypercorn asgi:app --workers 2`.
+#Both run the shared handlers of handlers.py. Here their queries go through an AsyncSession (run_sync), so a request
+#waiting on the database or a slow client does not hold a thread.
+#Requires the quart package and the async driver of the database (aiosqlite or asyncpg).
+import asyncio
+import logging
+import secrets
+import time
+from functools import wraps
+from quart import Quart, g, jsonify, request, session, Response, has_request_context
+from quart.sessions import SessionInterface
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from db import create_database, build_async_engine, LocalSession
+from auth import AuthenticationError, AuthorizationError
+from services.base import MAX_PAGE_SIZE
+from services.user import UserService
+from jobs import job_queue
+from metrics import db_counters
+from serializers import JSONProvider
+from sessions import ServerSideSessionInterface, build_session_store
+from web import (ERROR_STATUSES, error_response, wants_ndjson, set_validators, encode_rows, stream_mimetype, changes_args,
+    wants_event_stream, event_stream_start, change_event, KEEPALIVE_EVENT)
+import handlers
+import config
+
+class AsyncSessionInterface(SessionInterface):
+    #runs the server-side session interface on a worker thread, since its SQL store is synchronous
+    def __init__(self, interface: ServerSideSessionInterface):
+        self.interface = interface
+
+    async def open_session(self, app, request):
+        return await asyncio.to_thread(self.interface.open_session, app, request)
+
+    async def save_session(self, app, session, response):
+        await asyncio.to_thread(self.interface.save_session, app, session, response)
+
+app = Quart(__name__)
+app.json = JSONProvider(app)
+app.config['SECRET_KEY'] = config.SECRET_KEY or secrets.token_hex(16)
+app.session_interface = AsyncSessionInterface(ServerSideSessionInterface(build_session_store(LocalSession)))
+
+async_engine = build_async_engine()
+#instances outlive the commit that follows each handler, so they are not expired by it
+AsyncLocalSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+@app.before_serving
+async def start_job_workers():
+    #job handlers are the sync services, they run on the queue's own threads
+    job_queue.start()
+
+@app.after_serving
+async def dispose_engine():
+    await async_engine.dispose()
+
+@app.before_request
+async def count_request():
+    db_counters.increment('requests')
+
+def get_db():
+    if 'db' not in g:
+        g.db = AsyncLocalSession()
+        g.db_read_only = has_request_context() and request.method in READ_ONLY_METHODS
+        db_counters.increment('sessions_opened')
+    return g.db
+
+async def rollback_session():
+    db = g.get('db')
+    if db is not None and db.in_transaction():
+        await db.rollback()
+        db_counters.increment('rollbacks')
+
+@app.after_request
+async def commit_session(response):
+    #as in routes.commit_session, writes commit before the session store saves on its own connection
+    db = g.get('db')
+    if db is not None and not g.get('db_read_only') and response.status_code < 400 and db.in_transaction():
+        await db.commit()
+        db_counters.increment('commits')
+    return response
+
+@app.teardown_appcontext
+async def close_session(error):
+    db = g.pop('db', None)
+    if db is not None:
+        if error:
+            await db.rollback()
+            db_counters.increment('rollbacks')
+        elif g.pop('db_read_only', False):
+            pass
+        elif db.in_transaction():
+            await db.commit()
+            db_counters.increment('commits')
+        await db.close()
+
+def authenticate_session(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            raise AuthenticationError("Must be logged in")
+        return await f(*args, **kwargs)
+    return decorated_function
+
+def check_authorization(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if kwargs.get('user_id') != session['user_id']:
+            raise AuthorizationError("Access denied")
+        return await f(*args, **kwargs)
+    return decorated_function
+
+async def handle_error(e):
+    await rollback_session()
+    body, status, headers = error_response(e)
+    return jsonify(body), status, headers
+
+for error in ERROR_STATUSES:
+    app.errorhandler(error)(handle_error)
+
+@app.errorhandler(Exception)
+async def handle_general_error(e):
+    await rollback_session()
+    logging.error(f"Unexpected error in {request.endpoint}: {str(e)}", exc_info=True)
+    return (
+        jsonify({"error": str(e)}),
+        500
+    )
+
+async def json_body():
+    if request.method in READ_ONLY_METHODS or not request.is_json:
+        return None
+    return await request.get_json()
+
+def to_response(reply) -> Response:
+    if reply.stream is not None:
+        response = stream_pages(reply.stream)
+    elif reply.status == 304:
+        response = Response("", status=304)
+    else:
+        response = jsonify(reply.body)
+        response.status_code = reply.status
+    response.headers.update(reply.headers)
+    if reply.session is not None:
+        session.clear()
+        session.regenerate()
+        session.update(reply.session)
+    return set_validators(response, reply.validators)
+
+async def respond(handler, **view_args) -> Response:
+    data = await json_body()
+    #the handler runs on the request's AsyncSession, the proxied request is resolved for it
+    reply = await get_db().run_sync(handler, session['user_id'], request._get_current_object(), data, **view_args)
+    return to_response(reply)
+
+async def run_blocking(handler, *args) -> Response:
+    #Password hashing blocks, so user handlers run on a worker thread with a sync Session of their own and commit there
+    def run():
+        with LocalSession() as db:
+            reply = handler(db, *args)
+            db.commit()
+            return reply
+    return to_response(await asyncio.to_thread(run))
+
+def stream_pages(stream) -> Response:
+    #Async counterpart of routes.stream_rows. Rows are fetched one keyset page at a time on a session owned by the
+    #generator, since the request's session is closed at teardown while the body is still being written.
+    ndjson = wants_ndjson(request)
+    user_id = session['user_id']
+
+    def read_page(db, after):
+        service = stream.service_class(db, user_id)
+        return getattr(service, f"get_{stream.list_name}")(
+            *stream.parent_ids, after=after, limit=MAX_PAGE_SIZE, fields=stream.keys, **stream.options
+        )
+
+    async def generate():
+        first = True
+        if not ndjson:
+            yield f'{{"{stream.name}": ['
+        async with AsyncLocalSession() as db:
+            after = None
+            while True:
+                rows, after = await db.run_sync(read_page, after)
+                for chunk in encode_rows(app.json.dumps, rows, stream.keys, ndjson, first):
+                    yield chunk
+                first = first and not rows
+                if after is None:
+                    break
+        if not ndjson:
+            yield ']}'
+
+    return Response(generate(), mimetype=stream_mimetype(ndjson))
+
+@app.route("/")
+async def home():
+    return handlers.HOME_PAGE
+
+@app.route("/metrics", methods=['GET'])
+async def metrics():
+    return to_response(handlers.metrics(app.session_interface.interface.cache))
+
+@app.route("/signup", methods=['POST'])
+async def user_signup():
+    return await run_blocking(handlers.signup, await request.get_json())
+
+@app.route("/login", methods=['POST'])
+async def user_login():
+    return await run_blocking(handlers.login, await request.get_json())
+
+@app.route("/logout", methods=['POST'])
+@authenticate_session
+async def user_logout():
+    UserService.for_public(None).logout_user(session)
+    return jsonify({"message": "Logged out"}), 200
+
+@app.route("/users/<int:user_id>/change_password", methods=['PATCH'])
+@authenticate_session
+@check_authorization
+async def change_user_password(user_id):
+    response = await run_blocking(handlers.change_password, user_id, await request.get_json())
+    session.regenerate()
+    return response
+
+@app.route("/users/<int:user_id>/change_email", methods=['PATCH'])
+@authenticate_session
+@check_authorization
+async def change_user_email(user_id):
+    return await run_blocking(handlers.change_email, user_id, await request.get_json())
+
+@app.route("/projects", methods=['POST', 'GET'])
+@authenticate_session
+async def handle_projects_route():
+    return await respond(handlers.projects)
+
+@app.route("/projects/summary", methods=['GET'])
+@authenticate_session
+async def handle_projects_summary_route():
+    return await respond(handlers.projects_summary)
+
+@app.route("/projects/<int:project_id>", methods=['GET', 'PATCH', 'DELETE'])
+@authenticate_session
+async def handle_project_route(project_id):
+    return await respond(handlers.project, project_id=project_id)
+
+@app.route("/projects/<int:project_id>/tree", methods=['GET'])
+@authenticate_session
+async def handle_project_tree_route(project_id):
+    return await respond(handlers.tree, project_id=project_id)
+
+@app.route("/projects/<int:project_id>/features", methods=['GET', 'POST'])
+@authenticate_session
+async def handle_features_route(project_id):
+    return await respond(handlers.features, project_id=project_id)
+
+@app.route("/projects/<int:project_id>/tasks", methods=['GET'])
+@authenticate_session
+async def handle_project_tasks_route(project_id):
+    return await respond(handlers.project_tasks, project_id=project_id)
+
+@app.route("/features/<int:feature_id>", methods=['GET', 'PATCH', 'DELETE'])
+@authenticate_session
+async def handle_feature_route(feature_id):
+    return await respond(handlers.feature, feature_id=feature_id)
+
+@app.route("/features/<int:feature_id>/tasks", methods=['GET', 'POST'])
+@authenticate_session
+async def handle_tasks_route(feature_id):
+    return await respond(handlers.tasks, feature_id=feature_id)
+
+@app.route("/features/<int:feature_id>/tasks:batch", methods=['POST'])
+@authenticate_session
+async def handle_tasks_batch_create_route(feature_id):
+    return await respond(handlers.tasks_batch_create, feature_id=feature_id)
+
+@app.route("/tasks:batch", methods=['PATCH', 'DELETE'])
+@authenticate_session
+async def handle_tasks_batch_route():
+    return await respond(handlers.tasks_batch)
+
+@app.route("/tasks/<int:task_id>", methods=['GET', 'PATCH', 'DELETE'])
+@authenticate_session
+async def handle_task_route(task_id):
+    return await respond(handlers.task, task_id=task_id)
+
+@app.route("/tasks/<int:task_id>/notes", methods=['GET', 'POST'])
+@authenticate_session
+async def handle_notes_route(task_id):
+    return await respond(handlers.notes, task_id=task_id)
+
+@app.route("/tasks/<int:task_id>/notes:batch", methods=['POST'])
+@authenticate_session
+async def handle_notes_batch_create_route(task_id):
+    return await respond(handlers.notes_batch_create, task_id=task_id)
+
+@app.route("/notes:batch", methods=['PATCH', 'DELETE'])
+@authenticate_session
+async def handle_notes_batch_route():
+    return await respond(handlers.notes_batch)
+
+@app.route("/notes/<int:note_id>", methods=['GET', 'PATCH', 'DELETE'])
+@authenticate_session
+async def handle_note_route(note_id):
+    return await respond(handlers.note, note_id=note_id)
+
+@app.route("/projects/<int:project_id>:export", methods=['POST'])
+@authenticate_session
+async def handle_project_export_route(project_id):
+    return await respond(handlers.project_export, project_id=project_id)
+
+@app.route("/projects:import", methods=['POST'])
+@authenticate_session
+async def handle_project_import_route():
+    return await respond(handlers.project_import)
+
+@app.route("/projects:recompute-progress", methods=['POST'])
+@authenticate_session
+async def handle_recompute_progress_route():
+    return await respond(handlers.recompute_progress)
+
+@app.route("/jobs", methods=['GET'])
+@authenticate_session
+async def handle_jobs_route():
+    return await respond(handlers.jobs)
+
+@app.route("/jobs/<int:job_id>", methods=['GET'])
+@authenticate_session
+async def handle_job_route(job_id):
+    return await respond(handlers.job, job_id=job_id)
+
+@app.route("/search", methods=['GET'])
+@authenticate_session
+async def handle_search_route():
+    return await respond(handlers.search)
+
+async def read_changes(user_id, since, limit=None):
+    async with AsyncLocalSession() as db:
+        return await db.run_sync(handlers.read_changes, user_id, since, limit)
+
+async def read_latest_cursor(user_id):
+    async with AsyncLocalSession() as db:
+        return await db.run_sync(handlers.latest_cursor, user_id)
+
+def stream_changes(user_id, since) -> Response:
+    #Async counterpart of routes.stream_changes. Holding an event stream open costs no thread here, which makes
+    #this the better mode for many connected clients
+    async def generate():
+        cursor = since
+        deadline = time.monotonic() + config.CHANGES_STREAM_MAX_S
+        yield event_stream_start()
+        while time.monotonic() < deadline:
+            changes, cursor = await read_changes(user_id, cursor)
+            for change in changes:
+                yield change_event(app.json.dumps, change)
+            if not changes:
+                yield KEEPALIVE_EVENT
+                await asyncio.sleep(config.CHANGES_POLL_INTERVAL_S)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    response.timeout = None
+    return response
+
+@app.route("/changes", methods=['GET'])
+@authenticate_session
+async def handle_changes_route():
+    user_id = session['user_id']
+    since, limit, wait = changes_args(request)
+
+    if wants_event_stream(request):
+        if since is None:
+            since = await read_latest_cursor(user_id)
+        await read_changes(user_id, since, 1)
+        return stream_changes(user_id, since)
+
+    if since is None:
+        return to_response(handlers.changes_reply([], await get_db().run_sync(handlers.latest_cursor, user_id)))
+    deadline = time.monotonic() + wait
+    changes, cursor = await read_changes(user_id, since, limit)
+    while not changes and time.monotonic() < deadline:
+        await asyncio.sleep(min(config.CHANGES_POLL_INTERVAL_S, deadline - time.monotonic()))
+        changes, cursor = await read_changes(user_id, since, limit)
+    return to_response(handlers.changes_reply(changes, cursor))
+
+if __name__ == "__main__":
+    #development server only. Under an ASGI server the schema is created once by `flask --app app init-db`
+    create_database()
+    app.run(debug=True, port=5001)
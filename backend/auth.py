@@ -1,21 +1,166 @@
+import multiprocessing
+import secrets
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from functools import wraps
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 from email_validator import validate_email, EmailNotValidError
 from flask import session, jsonify
+import config
+
+_worker_hashers = {}
+
+def _worker_hasher(params: dict) -> PasswordHasher:
+    #one hasher per parameter set, cached inside each pool process
+    key = tuple(sorted(params.items()))
+    if key not in _worker_hashers:
+        _worker_hashers[key] = PasswordHasher(**params)
+    return _worker_hashers[key]
+
+def _hash(params: dict, password):
+    return _worker_hasher(params).hash(password)
+
+def _verify(params: dict, hash, password):
+    try:
+        return _worker_hasher(params).verify(hash, password)
+    except VerifyMismatchError:
+        return False
+
+class HashingPool:
+    #Argon2 is CPU bound, so it runs on a process pool instead of the request threads. Two limits apply:
+    #running hashes are capped per host by a semaphore created before gunicorn forks (preload_app), so every server
+    #worker shares it, and each worker admits at most workers + max_pending calls, the rest fail fast with
+    #HashingUnavailableError. An admitted call waits at most `wait` seconds for a host-wide slot, so a saturated host
+    #answers 503 quickly instead of parking request threads. A call holds its slots until its hash finishes, even if
+    #the caller timed out.
+    def __init__(self, workers: int, max_pending: int, timeout: float, wait: float = config.HASH_WAIT_S):
+        self.workers = workers
+        self.timeout = timeout
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_pending)
+        self._running = multiprocessing.BoundedSemaphore(max(workers, 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingUnavailableError("Too many authentication requests, try again shortly")
+        if not self._running.acquire(timeout=self.wait):
+            self._slots.release()
+            raise HashingUnavailableError("Too many authentication requests, try again shortly")
+        deadline = time.monotonic() + self.timeout
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._discard_executor(executor)
+            raise HashingUnavailableError("Authentication is restarting, try again shortly")
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            raise HashingUnavailableError("Authentication timed out, try again shortly")
+        except BrokenProcessPool:
+            #a pool process died (e.g killed for memory), the pool is unusable and the next call starts a new one
+            self._discard_executor(executor)
+            raise HashingUnavailableError("Authentication is restarting, try again shortly")
+
+    def _release(self, future=None):
+        self._running.release()
+        self._slots.release()
+
+    def warm(self):
+        #starts the pool now rather than on the first login. Under fork the first submit starts all HASH_WORKERS
+        #processes, so each server worker has its own set; the host-wide limit keeps HASH_WORKERS of them busy in total
+        if self.workers > 0:
+            self._get_executor().submit(int).result()
+
+    def _get_executor(self):
+        #Created on first use so forked server workers each start their own pool. Daemonic processes, e.g hypercorn's
+        #workers, cannot have children, there hashes run on threads (argon2 releases the GIL while it hashes)
+        with self._lock:
+            if self._executor is None:
+                if multiprocessing.current_process().daemon:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+hashing_pool = HashingPool(config.HASH_WORKERS, config.HASH_QUEUE_DEPTH, config.HASH_TIMEOUT_S)
+
 class Authenticator(PasswordHasher):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, time_cost=config.ARGON2_TIME_COST, memory_cost=config.ARGON2_MEMORY_COST, parallelism=config.ARGON2_PARALLELISM):
+        super().__init__(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        self.params = {'time_cost': time_cost, 'memory_cost': memory_cost, 'parallelism': parallelism}
+        self._dummy_hash = None
 
     def hash_password(self, password):
-        hashed = self.hash(password)
+        hashed = hashing_pool.run(_hash, self.params, password)
         return hashed
 
     def authenticate_password(self, hash, password):
-        try:
-            return self.verify(hash, password)
-        except VerifyMismatchError:
-            return False
+        return hashing_pool.run(_verify, self.params, hash, password)
+
+    def dummy_verify(self, password):
+        #verify against a throwaway hash with the current parameters, costing the same as a real check
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash_password(secrets.token_hex(16))
+        self.authenticate_password(self._dummy_hash, password)
+        return False
+
+    def needs_rehash(self, hash) -> bool:
+        #true when the stored hash was made with different cost parameters than the current ones
+        return self.check_needs_rehash(hash)
+
+    @staticmethod
+    def calibrate(target_ms=50, parallelism=config.ARGON2_PARALLELISM, max_memory_cost=1024 * 1024) -> dict:
+        #Benchmarks this host and returns the strongest parameters whose verify stays within target_ms.
+        #Memory cost is raised first (doubling from 8 MiB), then time cost at that memory cost.
+        def verify_ms(params):
+            hasher = PasswordHasher(**params)
+            hashed = hasher.hash("calibration-password")
+            samples = []
+            for _ in range(3):
+                start = time.perf_counter()
+                hasher.verify(hashed, "calibration-password")
+                samples.append((time.perf_counter() - start) * 1000)
+            return statistics.median(samples)
+
+        params = {'time_cost': 1, 'memory_cost': 8 * 1024, 'parallelism': parallelism}
+        elapsed = verify_ms(params)
+        while params['memory_cost'] * 2 <= max_memory_cost:
+            candidate = dict(params, memory_cost=params['memory_cost'] * 2)
+            candidate_elapsed = verify_ms(candidate)
+            if candidate_elapsed > target_ms:
+                break
+            params, elapsed = candidate, candidate_elapsed
+        while True:
+            candidate = dict(params, time_cost=params['time_cost'] + 1)
+            candidate_elapsed = verify_ms(candidate)
+            if candidate_elapsed > target_ms:
+                break
+            params, elapsed = candidate, candidate_elapsed
+        return dict(params, verify_ms=round(elapsed, 1))
         
     @staticmethod
     def email_validation(email):
@@ -37,8 +182,8 @@ class Authenticator(PasswordHasher):
     
     @staticmethod
     def check_authorization(f):
-        #Only run on routes with user_id as a parameter. Service level authorization is performed via joins. 
-        #Might update routes to take user_id for better service performance, but for now we move.
+        #Only run on routes with user_id as a parameter. Service level authorization filters on the owner_id
+        #carried by every feature, task and note, so it never needs joins.
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if kwargs.get('user_id') != session['user_id']: 
@@ -50,4 +195,7 @@ class AuthenticationError(Exception):
     pass
 
 class AuthorizationError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class HashingUnavailableError(Exception):
+    pass
@@ -0,0 +1,520 @@
+import os
+import sys
+import tempfile
+
+#Benchmarks for the performance settings and code paths, run from backend/: `python bench.py [scenario ...]`, all
+#scenarios by default. Each run uses a throwaway SQLite database, its own unless DATABASE_URL is set, and prints
+#what it measured. Numbers depend on the host, compare runs on the same machine.
+#Settings are read when config is imported, so they are set up before any app module loads
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("WEB_WORKERS", "1")
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("INSTRUMENTATION_ENABLED", "1")
+os.environ.setdefault("SLOW_QUERY_MS", "100000")
+
+import argparse
+import http.client
+import json
+import random
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from sqlalchemy import select, text, func, insert
+import config
+from db import create_database, build_engine, LocalSession
+from models import Project, Feature, Task, Note, ChangeLog
+from serializers import FEATURE, TASK, NOTE
+from services.base import BaseService, entity_cache
+from services.project import ProjectService
+from instrumentation import assert_max_queries
+import auth
+import jobs
+from app import create_app
+
+EMAIL, PASSWORD = 'bench@example.com', 'benchmark1'
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+    return f"p50 {statistics.median(values):.2f} ms, p99 {p99:.2f} ms"
+
+def timed_ms(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+def request_queries(client, method, url, **kwargs):
+    #(ms, queries, response) of one test client request
+    with assert_max_queries(10 ** 9) as counter:
+        ms, response = timed_ms(lambda: getattr(client, method)(url, **kwargs))
+    return ms, counter.count, response
+
+def logged_in_client(app):
+    client = app.test_client()
+    client.post('/signup', json={'name': 'Bench', 'email': EMAIL, 'password': PASSWORD, 'confirm_password': PASSWORD})
+    assert client.post('/login', json={'email': EMAIL, 'password': PASSWORD}).status_code == 200
+    return client
+
+def seed_project(client, tasks: int, features: int = 10) -> int:
+    #a project of `features` features sharing `tasks` tasks, one task in ten has a note
+    project_id = client.post('/projects', json={'name': 'Bench project'}).get_json()['new_project']['id']
+    words = ['alpha', 'beta', 'gamma', 'delta', 'release', 'migration', 'backend', 'invoice', 'login', 'search']
+    for f in range(features):
+        feature_id = client.post(f'/projects/{project_id}/features', json={'name': f'Feature {f}'}).get_json()['feature']['id']
+        batch = [{'name': f'{random.choice(words)} task {f}-{i}', 'description': ' '.join(random.sample(words, 4)),
+            'points': random.randint(1, 10), 'completed': random.random() < 0.3} for i in range(tasks // features)]
+        task_ids = client.post(f'/features/{feature_id}/tasks:batch', json={'tasks': batch}).get_json()['task_ids']
+        for task_id in task_ids[::10]:
+            client.post(f'/tasks/{task_id}/notes', json={'content': f'{random.choice(words)} note'})
+    return project_id
+
+def task_ids_of(project_id) -> list:
+    with LocalSession() as db:
+        return db.scalars(select(Task.id).join(Feature).filter(Feature.project_id == project_id)).all()
+
+#scenarios, each takes the parsed options
+
+def bench_sqlite(options):
+    #user-006: commit throughput of the tuned SQLite profile (WAL, synchronous=NORMAL) against SQLite's defaults, alone
+    #and with 4 threads reading while the writer commits
+    profiles = {'tuned WAL/NORMAL': ('WAL', 'NORMAL'), 'default DELETE/FULL': ('DELETE', 'FULL')}
+    saved = config.SQLITE_JOURNAL_MODE, config.SQLITE_SYNCHRONOUS
+    try:
+        for name, (journal_mode, synchronous) in profiles.items():
+            config.SQLITE_JOURNAL_MODE, config.SQLITE_SYNCHRONOUS = journal_mode, synchronous
+            engine = build_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'profile.db')}")
+            with engine.begin() as connection:
+                connection.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+            commits = 500
+            start = time.perf_counter()
+            for i in range(commits):
+                with engine.begin() as connection:
+                    connection.execute(text("INSERT INTO t (v) VALUES (:v)"), {'v': f'row {i}'})
+            elapsed = time.perf_counter() - start
+            print(f"sqlite {name}: {commits / elapsed:.0f} single-row commits/s")
+
+            counts, stop = {'commits': 0, 'reads': 0, 'errors': 0}, threading.Event()
+
+            def write():
+                while not stop.is_set():
+                    try:
+                        with engine.begin() as connection:
+                            connection.execute(text("INSERT INTO t (v) VALUES ('row')"))
+                        counts['commits'] += 1
+                    except Exception:
+                        counts['errors'] += 1
+
+            def read():
+                while not stop.is_set():
+                    try:
+                        with engine.connect() as connection:
+                            connection.execute(text("SELECT count(*), max(id) FROM t")).all()
+                        counts['reads'] += 1
+                    except Exception:
+                        counts['errors'] += 1
+
+            threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            time.sleep(2)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            print(f"sqlite {name}, 1 writer and 4 readers: {counts['commits'] / 2:.0f} commits/s, "
+                f"{counts['reads'] / 2:.0f} reads/s, {counts['errors']} errors")
+            engine.dispose()
+    finally:
+        config.SQLITE_JOURNAL_MODE, config.SQLITE_SYNCHRONOUS = saved
+
+def bench_ownership(options):
+    #user-009: authorizing by the owner_id column against the join through features and projects, for one task, a
+    #page of a feature's tasks and one note, the deepest entity
+    task_ids = task_ids_of(options.project_id)
+    joined = "JOIN features ON features.id = tasks.feature_id JOIN projects ON projects.id = features.project_id"
+    queries = {
+        'task owner_id': "SELECT tasks.id, tasks.name FROM tasks WHERE tasks.id = :id AND tasks.owner_id = :user",
+        'task join': f"SELECT tasks.id, tasks.name FROM tasks {joined} WHERE tasks.id = :id AND projects.parent_userid = :user",
+        'page owner_id': "SELECT tasks.id, tasks.name FROM tasks WHERE tasks.feature_id = :feature AND tasks.owner_id = :user "
+            "ORDER BY tasks.id LIMIT 100",
+        'page join': f"SELECT tasks.id, tasks.name FROM tasks {joined} WHERE tasks.feature_id = :feature "
+            "AND projects.parent_userid = :user ORDER BY tasks.id LIMIT 100",
+        'note owner_id': "SELECT work_notes.id, work_notes.content FROM work_notes WHERE work_notes.id = :note "
+            "AND work_notes.owner_id = :user",
+        'note join': f"SELECT work_notes.id, work_notes.content FROM work_notes JOIN tasks ON tasks.id = work_notes.task_id "
+            f"{joined} WHERE work_notes.id = :note AND projects.parent_userid = :user",
+    }
+    with LocalSession() as db:
+        user_id = db.scalar(select(Project.parent_userid).filter(Project.id == options.project_id))
+        feature_ids = db.scalars(select(Feature.id).filter(Feature.project_id == options.project_id)).all()
+        note_ids = db.scalars(select(Note.id).filter(Note.task_id.in_(task_ids[::10]))).all()
+        for name, statement in queries.items():
+            samples = [{'id': random.choice(task_ids), 'feature': random.choice(feature_ids), 'note': random.choice(note_ids),
+                'user': user_id} for _ in range(2000)]
+            start = time.perf_counter()
+            for parameters in samples:
+                db.execute(text(statement), parameters).all()
+            print(f"ownership {name}: {(time.perf_counter() - start) / len(samples) * 1e6:.1f} us per query")
+
+def bench_hashing(options):
+    #user-011: 16 logins' worth of verifies from 8 threads, inline on the threads and on the process pool. The ticker
+    #measures how late a 5 ms sleep on another thread wakes up, i.e. how much hashing stalls the rest of the process
+    hasher = auth.Authenticator()
+    stored = hasher.hash_password(PASSWORD)
+    pool = auth.HashingPool(config.HASH_WORKERS, 16, 30, wait=30)
+    pool.warm()
+    runners = {'inline': lambda *args: auth._verify(*args), 'pool': lambda *args: pool.run(auth._verify, *args)}
+    for name, verify in runners.items():
+        lateness, stop = [], threading.Event()
+
+        def tick():
+            while not stop.is_set():
+                start = time.perf_counter()
+                time.sleep(0.005)
+                lateness.append((time.perf_counter() - start) * 1000 - 5)
+
+        ticker = threading.Thread(target=tick)
+        ticker.start()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=lambda: [verify(hasher.params, stored, PASSWORD) for _ in range(2)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        ticker.join()
+        print(f"hashing {name}: 16 verifies in {elapsed * 1000:.0f} ms, other thread wakes late by {percentiles(lateness)}")
+
+def bench_auth(options):
+    #user-013: queries and time of the account requests, a duplicate signup is refused before hashing
+    client = options.app.test_client()
+    results = {}
+    for i in range(5):
+        email = f'auth{i}-{random.random()}@example.com'
+        signup = {'name': 'A', 'email': email, 'password': PASSWORD, 'confirm_password': PASSWORD}
+        for name, method, url, body in (
+            ('signup', 'post', '/signup', signup),
+            ('duplicate signup', 'post', '/signup', signup),
+            ('login', 'post', '/login', {'email': email, 'password': PASSWORD}),
+            ('wrong password', 'post', '/login', {'email': email, 'password': 'wrong-password'}),
+        ):
+            ms, queries, _ = request_queries(client, method, url, json=body)
+            results.setdefault(name, []).append((ms, queries))
+    for name, samples in results.items():
+        print(f"auth {name}: {samples[-1][1]} queries, {percentiles([ms for ms, _ in samples])}")
+
+def bench_stream(options):
+    #user-015: peak memory and time of all tasks of the project, streamed as NDJSON against one JSON document
+    client, dumps = options.client, options.app.json.dumps
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f'/projects/{options.project_id}/tasks?format=ndjson', buffered=False)
+    lines = sum(chunk.count(b'\n') for chunk in response.response)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"stream ndjson: {lines} rows in {elapsed * 1000:.0f} ms, peak {peak / 1e6:.1f} MB")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with LocalSession() as db:
+        rows = db.execute(select(*[getattr(Task, f) for f in TASK.fields]).join(Feature).filter(Feature.project_id == options.project_id)).all()
+        body = dumps({'tasks': TASK.dump_rows(rows)})
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"stream whole document: {len(rows)} rows in {elapsed * 1000:.0f} ms, peak {peak / 1e6:.1f} MB, {len(body) / 1e6:.1f} MB body")
+
+def bench_serialize(options):
+    #user-016: per model, column rows zipped by the serializer against ORM instances dumped field by field
+    dumps = options.app.json.dumps
+    task_ids = select(Task.id).join(Feature).filter(Feature.project_id == options.project_id)
+    models = (
+        ('features', Feature, FEATURE, Feature.project_id == options.project_id),
+        ('tasks', Task, TASK, Task.id.in_(task_ids)),
+        ('notes', Note, NOTE, Note.task_id.in_(task_ids)),
+    )
+    with LocalSession() as db:
+        for name, model, serializer, where in models:
+            rows_ms, rows = timed_ms(lambda: serializer.dump_rows(db.execute(select(*[getattr(model, f) for f in serializer.fields]).filter(where)).all()))
+            dumps(rows)
+            db.expunge_all()
+            orm_ms, _ = timed_ms(lambda: dumps([serializer.dump(i) for i in db.scalars(select(model).filter(where)).all()]))
+            print(f"serialize {len(rows)} {name}: column rows {len(rows) / rows_ms:.0f} rows/ms, ORM instances {len(rows) / orm_ms:.0f} rows/ms")
+
+def bench_cache(options):
+    #user-018: GET /tasks/<id> with the entity cache and without it
+    if entity_cache is None:
+        print("cache: skipped, ENTITY_CACHE_BACKEND is none")
+        return
+    task_ids = random.sample(task_ids_of(options.project_id), 200)
+    saved = BaseService.cache
+    try:
+        for name, cache in (('cache', entity_cache), ('no cache', None)):
+            BaseService.cache = cache
+            for task_id in task_ids:
+                options.client.get(f'/tasks/{task_id}')
+            samples = [request_queries(options.client, 'get', f'/tasks/{task_id}') for task_id in task_ids]
+            print(f"cache {name}: {samples[-1][1]} queries per GET /tasks/<id>, {percentiles([ms for ms, _, _ in samples])}")
+    finally:
+        BaseService.cache = saved
+
+def bench_search(options):
+    #user-021: ranked search over the project's tasks, features and notes, plus --notes notes inserted in bulk
+    if options.notes:
+        words = ['alpha', 'beta', 'gamma', 'delta', 'release', 'migration', 'backend', 'invoice', 'login', 'search',
+            'deploy', 'schema', 'client', 'report', 'cache', 'queue']
+        task_ids = task_ids_of(options.project_id)
+        with LocalSession() as db:
+            user_id = db.scalar(select(Project.parent_userid).filter(Project.id == options.project_id))
+            start = time.perf_counter()
+            for offset in range(0, options.notes, 10000):
+                db.execute(insert(Note), [{'task_id': random.choice(task_ids), 'owner_id': user_id,
+                    'content': ' '.join(random.choices(words, k=12))} for _ in range(min(10000, options.notes - offset))])
+            db.commit()
+        print(f"search: inserted {options.notes} notes in {time.perf_counter() - start:.1f} s")
+    for q in ('migration', 'invoice login', 'gam'):
+        samples = [request_queries(options.client, 'get', f'/search?q={q}') for _ in range(20)]
+        found = len(samples[-1][2].get_json()['results'])
+        print(f"search '{q}': {found} results, {samples[-1][1]} queries, {percentiles([ms for ms, _, _ in samples])}")
+
+def bench_purge(options):
+    #user-024: deleting a project in one cascading transaction against the chunked purge job. The longest transaction
+    #is how long other writers wait on the SQLite write lock
+    client = options.client
+    with LocalSession() as db:
+        cursor = db.scalar(select(func.max(ChangeLog.id))) or 0
+    project_id = seed_project(client, options.tasks)
+    with LocalSession() as db:
+        user_id = db.scalar(select(Project.parent_userid).filter(Project.id == project_id))
+        ms, _ = timed_ms(lambda: (ProjectService(db, user_id).delete_project(project_id), db.commit()))
+        logged = db.scalar(select(func.count(ChangeLog.id)).filter(ChangeLog.id > cursor, ChangeLog.operation == 'delete'))
+    print(f"purge single transaction: {options.tasks} tasks in {ms:.0f} ms, {logged} change log rows")
+
+    project_id = seed_project(client, options.tasks)
+    with LocalSession() as db:
+        cursor = db.scalar(select(func.max(ChangeLog.id)))
+        transactions, commit = [], db.commit
+        last = [time.perf_counter()]
+
+        def timed_commit():
+            commit()
+            now = time.perf_counter()
+            transactions.append((now - last[0]) * 1000)
+            last[0] = now
+
+        db.commit = timed_commit
+        jobs.purge_project(db, user_id, {'project_id': project_id})
+        timed_commit()
+        logged = db.scalar(select(func.count(ChangeLog.id)).filter(ChangeLog.id > cursor))
+    print(f"purge job, {config.DELETE_CHUNK_SIZE} per chunk: {sum(transactions):.0f} ms in {len(transactions)} transactions, "
+        f"longest {max(transactions):.0f} ms, {logged} change log rows")
+
+#served scenarios, run the real servers as subprocesses on the benchmark database
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(kind, port, **env):
+    #kind is 'wsgi' (gunicorn with gunicorn.conf.py), 'asgi' (hypercorn) or 'dev' (the Flask development server)
+    env = {**os.environ, 'WEB_BIND': f'127.0.0.1:{port}', 'WEB_WORKERS': '1', 'JOB_WORKERS': '0', **env}
+    if kind == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', 'wsgi:app']
+    elif kind == 'dev':
+        command = [sys.executable, '-m', 'flask', '--app', 'app:create_app', 'run', '--port', str(port)]
+    else:
+        command = [sys.executable, '-m', 'hypercorn', 'asgi:app', '--bind', f'127.0.0.1:{port}', '--workers', '1']
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+def stop_server(process):
+    process.terminate()
+    process.wait(timeout=30)
+
+class HttpClient:
+    #one keep-alive connection with the session cookie of a login
+    def __init__(self, port, cookie=None):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = cookie
+
+    def request(self, method, url, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            #the server closed the idle keep-alive connection, reconnect once
+            self.connection.close()
+            self.connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';')[0]
+        return response.status, data, (time.perf_counter() - start) * 1000
+
+def run_clients(port, cookie, count, seconds, url):
+    #count clients sending GET url back to back for seconds, returns (latencies, errors)
+    latencies, errors, deadline = [], [], time.monotonic() + seconds
+
+    def client():
+        http_client = HttpClient(port, cookie)
+        while time.monotonic() < deadline:
+            status, _, ms = http_client.request('GET', url)
+            (latencies if status == 200 else errors).append(ms)
+
+    threads = [threading.Thread(target=client) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def bench_load(options):
+    #user-019: the WSGI server (gunicorn gthread, WEB_THREADS threads) against the ASGI app (hypercorn), one worker
+    #each. Plain reads, then the same reads while long polls of /changes wait
+    url = f'/projects/{options.project_id}/tasks?limit=100'
+    for kind in ('wsgi', 'asgi'):
+        port = free_port()
+        server = start_server(kind, port)
+        try:
+            login = HttpClient(port)
+            login.request('POST', '/login', {'email': EMAIL, 'password': PASSWORD})
+            cookie = login.cookie
+            cursor = json.loads(login.request('GET', '/changes')[1])['cursor']
+            latencies, errors = run_clients(port, cookie, 16, options.seconds, url)
+            print(f"load {kind} reads, 16 clients: {len(latencies) / options.seconds:.0f} req/s, {percentiles(latencies)}, {len(errors)} errors")
+
+            polls = []
+
+            def poll():
+                http_client = HttpClient(port, cookie)
+                deadline = time.monotonic() + options.seconds
+                while time.monotonic() < deadline:
+                    status = http_client.request('GET', f'/changes?since={cursor}&wait=2')[0]
+                    polls.append(status)
+                    if status == 503:
+                        #as a client honouring Retry-After would
+                        time.sleep(min(config.CHANGES_POLL_INTERVAL_S + 1, max(deadline - time.monotonic(), 0)))
+
+            pollers = [threading.Thread(target=poll) for _ in range(8)]
+            for thread in pollers:
+                thread.start()
+            latencies, errors = run_clients(port, cookie, 8, options.seconds, url)
+            for thread in pollers:
+                thread.join()
+            print(f"load {kind} reads, 8 clients with 8 waiting long polls: {len(latencies) / options.seconds:.0f} req/s, "
+                f"{percentiles(latencies)}, {len(errors)} errors, {polls.count(503)} of {len(polls)} polls refused")
+        finally:
+            stop_server(server)
+
+def bench_storm(options):
+    #user-011: API reads on gunicorn while 8 clients log in back to back, against the same reads on a quiet server.
+    #Hashes run on the process pool (HASH_WORKERS), then inline on the request threads (HASH_WORKERS=0)
+    url = f'/projects/{options.project_id}/tasks?limit=100'
+    for workers in (str(config.HASH_WORKERS), '0'):
+        port = free_port()
+        server = start_server('wsgi', port, HASH_WORKERS=workers)
+        try:
+            login = HttpClient(port)
+            login.request('POST', '/login', {'email': EMAIL, 'password': PASSWORD})
+            latencies, errors = run_clients(port, login.cookie, 4, options.seconds, url)
+            print(f"storm HASH_WORKERS={workers} quiet, 4 readers: {len(latencies) / options.seconds:.0f} req/s, {percentiles(latencies)}")
+
+            logins, stop = [], threading.Event()
+
+            def log_in():
+                http_client = HttpClient(port)
+                while not stop.is_set():
+                    logins.append(http_client.request('POST', '/login', {'email': EMAIL, 'password': PASSWORD})[0])
+
+            stormers = [threading.Thread(target=log_in) for _ in range(8)]
+            for thread in stormers:
+                thread.start()
+            latencies, errors = run_clients(port, login.cookie, 4, options.seconds, url)
+            stop.set()
+            for thread in stormers:
+                thread.join()
+            print(f"storm HASH_WORKERS={workers}, 4 readers with 8 clients logging in: {len(latencies) / options.seconds:.0f} req/s, "
+                f"{percentiles(latencies)}, {logins.count(200)} logins, {logins.count(503)} refused with 503")
+        finally:
+            stop_server(server)
+
+def bench_startup(options):
+    #user-020: the Flask development server against gunicorn, with WARM_START (pool connections and hashing processes
+    #started in post_fork) and without: time to the first response, the first logins and read throughput
+    url = f'/projects/{options.project_id}/tasks?limit=100'
+    for name, kind, env in (('dev server', 'dev', {}), ('gunicorn WARM_START=1', 'wsgi', {'WARM_START': '1'}),
+            ('gunicorn WARM_START=0', 'wsgi', {'WARM_START': '0'})):
+        port = free_port()
+        start = time.perf_counter()
+        server = start_server(kind, port, **env)
+        try:
+            client = HttpClient(port)
+            while client.request('GET', '/')[0] != 200:
+                time.sleep(0.05)
+            ready = (time.perf_counter() - start) * 1000
+            time.sleep(1)
+            first = client.request('POST', '/login', {'email': EMAIL, 'password': PASSWORD})[2]
+            second = client.request('POST', '/login', {'email': EMAIL, 'password': PASSWORD})[2]
+            latencies, errors = run_clients(port, client.cookie, 16, options.seconds, url)
+            print(f"startup {name}: first response after {ready:.0f} ms, first login {first:.0f} ms, second {second:.0f} ms, "
+                f"16 readers {len(latencies) / options.seconds:.0f} req/s, {percentiles(latencies)}")
+        finally:
+            stop_server(server)
+
+SCENARIOS = {
+    'sqlite': bench_sqlite,
+    'ownership': bench_ownership,
+    'hashing': bench_hashing,
+    'auth': bench_auth,
+    'stream': bench_stream,
+    'serialize': bench_serialize,
+    'cache': bench_cache,
+    'search': bench_search,
+    'purge': bench_purge,
+    'load': bench_load,
+    'storm': bench_storm,
+    'startup': bench_startup,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the project tracker backend")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run, all by default: {', '.join(SCENARIOS)}")
+    parser.add_argument('--tasks', type=int, default=20000, help="Tasks in the benchmark project")
+    parser.add_argument('--seconds', type=float, default=5, help="Duration of each load run")
+    parser.add_argument('--notes', type=int, default=0, help="Notes added in bulk before the search scenario")
+    options = parser.parse_args()
+    unknown = [name for name in options.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario '{unknown[0]}'")
+
+    random.seed(1)
+    create_database()
+    options.app = create_app()
+    options.client = logged_in_client(options.app)
+    ms, options.project_id = timed_ms(seed_project, options.client, options.tasks)
+    print(f"seeded {options.tasks} tasks in {ms / 1000:.1f} s")
+    for name in options.scenarios or SCENARIOS:
+        SCENARIOS[name](options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_MISSING = object()
+
+class TTLCache:
+    #per-process LRU cache whose entries also expire ttl seconds after they were stored
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.monotonic():
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisCache:
+    #shared cache with the TTLCache interface, for any client exposing the redis get/setex/delete commands
+    def __init__(self, client, ttl: float, prefix="cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key) -> str:
+        return self.prefix + ":".join(str(part) for part in key) if isinstance(key, tuple) else self.prefix + str(key)
+
+    def get(self, key, default=None):
+        value = self.client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.setex(self._key(key), max(int(self.ttl), 1), pickle.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def build_entity_cache():
+    if config.ENTITY_CACHE_BACKEND == 'local':
+        return TTLCache(config.ENTITY_CACHE_SIZE, config.ENTITY_CACHE_TTL_S)
+    if config.ENTITY_CACHE_BACKEND == 'redis':
+        if redis is None:
+            raise RuntimeError("ENTITY_CACHE_BACKEND=redis requires the redis package")
+        return RedisCache(redis.Redis.from_url(config.REDIS_URL), config.ENTITY_CACHE_TTL_S)
+    if config.ENTITY_CACHE_BACKEND == 'none':
+        return None
+    raise RuntimeError(f"Unknown ENTITY_CACHE_BACKEND '{config.ENTITY_CACHE_BACKEND}'")
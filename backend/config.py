@@ -0,0 +1,97 @@
+import os
+
+#settings are read from the environment so deployments can differ without code changes
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///project_tracker.db")
+DB_ECHO = env_bool("DB_ECHO", False)
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+
+#tuned SQLite profile, applied to every new connection
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_MMAP_SIZE = env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+
+#per-request query instrumentation
+INSTRUMENTATION_ENABLED = env_bool("INSTRUMENTATION_ENABLED", True)
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOWEST_QUERIES_KEPT = env_int("SLOWEST_QUERIES_KEPT", 3)
+
+#argon2 cost parameters and the process pool that runs hashing off the request threads. HASH_WORKERS hashes run at once
+#per host: the limit is shared by the gunicorn workers forked from the preloaded app (per process otherwise)
+ARGON2_TIME_COST = env_int("ARGON2_TIME_COST", 3)
+ARGON2_MEMORY_COST = env_int("ARGON2_MEMORY_COST", 65536)
+ARGON2_PARALLELISM = env_int("ARGON2_PARALLELISM", 4)
+HASH_WORKERS = env_int("HASH_WORKERS", min(os.cpu_count() or 1, 4))
+HASH_QUEUE_DEPTH = env_int("HASH_QUEUE_DEPTH", 2 * HASH_WORKERS)
+HASH_TIMEOUT_S = float(os.environ.get("HASH_TIMEOUT_S", "10"))
+#how long a call waits for a host-wide hashing slot before it fails with 503, about a few hashes' time
+HASH_WAIT_S = float(os.environ.get("HASH_WAIT_S", "0.2"))
+
+#server-side sessions: "sql" (user_sessions table), "redis" (REDIS_URL) or "local" (in-process, single worker only)
+SECRET_KEY = os.environ.get("SECRET_KEY")
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sql")
+REDIS_URL = os.environ.get("REDIS_URL")
+SESSION_TTL_S = env_int("SESSION_TTL_S", 14 * 24 * 3600)
+#a revoked session can stay valid on other workers for at most SESSION_CACHE_TTL_S seconds
+SESSION_CACHE_TTL_S = float(os.environ.get("SESSION_CACHE_TTL_S", "5"))
+SESSION_CACHE_SIZE = env_int("SESSION_CACHE_SIZE", 10000)
+
+#production server (gunicorn.conf.py). Each worker is a process with WEB_THREADS request threads,
+#so DB_POOL_SIZE + DB_MAX_OVERFLOW should be at least WEB_THREADS
+WEB_BIND = os.environ.get("WEB_BIND", "0.0.0.0:5001")
+WEB_WORKERS = env_int("WEB_WORKERS", 2 * (os.cpu_count() or 1) + 1)
+WEB_THREADS = env_int("WEB_THREADS", 4)
+WEB_TIMEOUT_S = env_int("WEB_TIMEOUT_S", 30)
+#open the pool's connections and start the hashing processes when a worker boots, instead of on its first requests
+WARM_START = env_bool("WARM_START", True)
+
+#read cache for project/feature/task lookups: "local" (per-process LRU), "redis" (shared, REDIS_URL) or "none".
+#A "local" cache only sees the writes of its own worker, so with several workers a GET on another worker could serve
+#a row up to ENTITY_CACHE_TTL_S old and break read-your-writes. It is the default for a single worker only
+ENTITY_CACHE_BACKEND = os.environ.get("ENTITY_CACHE_BACKEND", "local" if WEB_WORKERS == 1 else "none")
+ENTITY_CACHE_SIZE = env_int("ENTITY_CACHE_SIZE", 10000)
+ENTITY_CACHE_TTL_S = float(os.environ.get("ENTITY_CACHE_TTL_S", "60"))
+
+#change feed (GET /changes). Long polls re-check every CHANGES_POLL_INTERVAL_S (writes in the same worker wake them at once)
+CHANGES_POLL_INTERVAL_S = float(os.environ.get("CHANGES_POLL_INTERVAL_S", "1"))
+CHANGES_MAX_WAIT_S = float(os.environ.get("CHANGES_MAX_WAIT_S", "30"))
+#server-sent event streams are closed after this long, clients reconnect with Last-Event-ID
+CHANGES_STREAM_MAX_S = float(os.environ.get("CHANGES_STREAM_MAX_S", "300"))
+CHANGES_RETENTION_DAYS = env_int("CHANGES_RETENTION_DAYS", 30)
+#event streams and waiting long polls each hold a request thread of the WSGI server, at most this many per worker
+#process so the others stay free for ordinary requests. The ASGI app holds no thread for them and has no cap
+CHANGES_MAX_WAITERS = env_int("CHANGES_MAX_WAITERS", max(WEB_THREADS // 2, 1))
+
+#deleting a project with at least BACKGROUND_DELETE_MIN_TASKS tasks returns 202 at once and a job empties it,
+#DELETE_CHUNK_SIZE tasks per transaction so other writers are not held up for the whole subtree
+BACKGROUND_DELETE_MIN_TASKS = env_int("BACKGROUND_DELETE_MIN_TASKS", 10000)
+DELETE_CHUNK_SIZE = env_int("DELETE_CHUNK_SIZE", 5000)
+
+#background jobs (jobs table). Every server process runs JOB_WORKERS worker threads, set it to 0 to run the jobs only
+#in dedicated `flask --app app run-jobs` processes. Idle workers re-check the table every JOB_POLL_INTERVAL_S
+JOB_WORKERS = env_int("JOB_WORKERS", 2)
+JOB_POLL_INTERVAL_S = float(os.environ.get("JOB_POLL_INTERVAL_S", "1"))
+JOB_MAX_ATTEMPTS = env_int("JOB_MAX_ATTEMPTS", 3)
+#a failed attempt is retried after JOB_RETRY_DELAY_S, doubled for each further attempt
+JOB_RETRY_DELAY_S = float(os.environ.get("JOB_RETRY_DELAY_S", "5"))
+#jobs running this long are assumed lost with their worker process and queued again. Each process sweeps for them
+#at most once per JOB_TIMEOUT_S, so idle polls stay read-only
+JOB_TIMEOUT_S = env_int("JOB_TIMEOUT_S", 3600)
+#per user: jobs running at once, and jobs queued or running before new ones are rejected with 429
+JOB_USER_CONCURRENCY = env_int("JOB_USER_CONCURRENCY", 1)
+JOB_USER_MAX_PENDING = env_int("JOB_USER_MAX_PENDING", 20)
@@ -1,12 +1,77 @@
+import config
+import instrumentation
 from models import Base
-from sqlalchemy import create_engine
+from migrations import upgrade_database
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///project_tracker.db"
+DATABASE_URL = config.DATABASE_URL
 
 
-engine = create_engine(DATABASE_URL, echo=True)
+#async drivers used by the ASGI app for each backend
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def engine_options(url) -> dict:
+    options = {
+        'echo': config.DB_ECHO,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+    }
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    #in-memory SQLite uses a per-thread pool that has no size settings
+    if not (is_sqlite and url.database in (None, '', ':memory:')):
+        options['pool_size'] = config.DB_POOL_SIZE
+        options['max_overflow'] = config.DB_MAX_OVERFLOW
+    return options
+
+def build_engine(url=DATABASE_URL):
+    url = make_url(url)
+    engine = create_engine(url, **engine_options(url))
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+    if config.INSTRUMENTATION_ENABLED:
+        instrumentation.install(engine)
+    return engine
+
+def build_async_engine(url=DATABASE_URL):
+    #same pool settings on the backend's async driver. Events are registered on the sync core the async engine wraps.
+    #Imported here, sqlalchemy.ext.asyncio needs greenlet, which the WSGI app does not
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = make_url(url)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+    engine = create_async_engine(url, **engine_options(url))
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+    if config.INSTRUMENTATION_ENABLED:
+        instrumentation.install(engine.sync_engine)
+    return engine
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    #WAL lets readers run alongside the single writer, NORMAL sync is safe in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+engine = build_engine()
 LocalSession = sessionmaker(engine)
 
+def warm_pool(engine, connections=config.DB_POOL_SIZE):
+    #checks out the connections at once so they are all opened (and their pragmas run) before traffic arrives
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
 def create_database():
     Base.metadata.create_all(engine)
+    upgrade_database(engine)
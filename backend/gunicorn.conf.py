@@ -0,0 +1,22 @@
+import config as app_config
+
+#gunicorn reads this file from the working directory: `gunicorn wsgi:app`. Module-level names are gunicorn settings,
+#so the app settings are imported under another name
+bind = app_config.WEB_BIND
+workers = app_config.WEB_WORKERS
+threads = app_config.WEB_THREADS
+worker_class = "gthread" if app_config.WEB_THREADS > 1 else "sync"
+timeout = app_config.WEB_TIMEOUT_S
+#the app is imported once in the master and forked, so workers boot without re-importing it
+preload_app = True
+
+def post_fork(server, worker):
+    from db import engine
+    #connections opened in the master must not be shared with the forked worker
+    engine.dispose(close=False)
+    if app_config.WARM_START:
+        from app import warm_up
+        warm_up()
+    #threads do not survive the fork, so each worker starts its own job workers
+    from jobs import job_queue
+    job_queue.start()
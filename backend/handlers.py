@@ -0,0 +1,285 @@
+from serializers import USER, PROJECT, FEATURE, TASK, NOTE, CHANGE, JOB
+from services.user import UserService
+from services.project import ProjectService, FeatureService, TaskService, NoteService
+from services.search import SearchService
+from services.changes import ChangeService
+from services.jobs import JobService
+from jobs import job_queue
+from metrics import db_counters, job_counters, job_timings
+from services.base import entity_cache
+from web import Reply, Stream, conditional, list_args, filter_args, flag_arg, wants_stream, project_tree
+import config
+
+#The route bodies, shared by the WSGI routes (routes.py) and the ASGI app (asgi.py). A handler takes a sync Session,
+#the user, the framework's request and its JSON body, and returns a Reply. The WSGI routes call them with the
+#request's session, the ASGI app runs them inside AsyncSession.run_sync so their queries await the async driver.
+
+HOME_PAGE = """
+    <h1>Welcome to the Project Tracker</h1>
+"""
+
+def metrics(session_cache) -> Reply:
+    return Reply({"db": db_counters.snapshot(), "session_cache": session_cache.stats(),
+        "entity_cache": entity_cache.stats() if entity_cache is not None else None,
+        "jobs": {**job_counters.snapshot(), "timings": job_timings.snapshot()}})
+
+#user handlers hash passwords, the ASGI app runs them on a worker thread instead of the event loop
+
+def signup(db, data) -> Reply:
+    user = UserService.for_public(db).create_user(data)
+    return Reply({"user created": USER.dump(user)}, 201)
+
+def login(db, data) -> Reply:
+    user = UserService.for_public(db).login_user(data)
+    return Reply({"user logged in": USER.dump(user)}, session={'user_id': user.id, 'user_email': user.email})
+
+def change_password(db, user_id, data) -> Reply:
+    UserService.for_user(db, user_id).change_user_password(user_id, data)
+    return Reply({"message": "Password changed successfully"})
+
+def change_email(db, user_id, data) -> Reply:
+    UserService.for_user(db, user_id).change_user_email(user_id, data)
+    return Reply({"message": "Email changed successfully"})
+
+def enqueue_job(db, user_id, kind, payload=None) -> Reply:
+    #the job becomes visible to the workers when the request commits, the response points to its status
+    job = JobService(db, user_id).enqueue_job(kind, payload)
+    job_counters.increment('queued')
+    job_queue.start()
+    return Reply({"job": JOB.dump(job)}, 202, {"Location": f"/jobs/{job.id}"})
+
+def projects(db, user_id, request, data) -> Reply:
+    project_service = ProjectService(db, user_id)
+
+    if request.method == 'GET':
+        args = filter_args(request, PROJECT)
+        count, last_id, last_modified = project_service.get_projects_validator()
+        reply = conditional(request, (count, last_id, last_modified), last_modified)
+        if reply.status == 304:
+            return reply
+        if wants_stream(request):
+            reply.stream = Stream('projects', ProjectService, 'projects', args['fields'], filters=args['filters'], sort=args['sort'])
+            return reply
+        projects, next_cursor = project_service.get_projects(**args)
+        reply.body = {"projects": PROJECT.dump_rows(projects, args['fields']), "next_cursor": next_cursor}
+        return reply
+
+    p = project_service.create_project(data)
+    return Reply({"new_project": PROJECT.dump(p)}, 201)
+
+def projects_summary(db, user_id, request, data) -> Reply:
+    return Reply({"projects": ProjectService(db, user_id).get_progress_summary()})
+
+def project(db, user_id, request, data, project_id) -> Reply:
+    project_service = ProjectService(db, user_id)
+
+    if request.method == 'GET':
+        p = project_service.get_project(project_id)
+        reply = conditional(request, (p.id, p.updated_at), p.updated_at)
+        if reply.status == 304:
+            return reply
+        reply.body = {"project": PROJECT.dump(p)}
+        return reply
+    elif request.method == 'PATCH':
+        p = project_service.update_project(project_id, data)
+        return Reply({"project": PROJECT.dump(p)})
+
+    if project_service.count_project_tasks(project_id) >= config.BACKGROUND_DELETE_MIN_TASKS:
+        #a single cascading DELETE of the subtree would hold the write lock for too long
+        return enqueue_job(db, user_id, 'purge_project', {'project_id': project_id})
+    project_service.delete_project(project_id)
+    return Reply({"project_deleted": project_id})
+
+def tree(db, user_id, request, data, project_id) -> Reply:
+    include_notes = flag_arg(request, 'notes')
+    p, note_counts = ProjectService(db, user_id).get_project_tree(project_id, include_notes)
+    return Reply({"project": project_tree(p, note_counts, include_notes)})
+
+def features(db, user_id, request, data, project_id) -> Reply:
+    feature_service = FeatureService(db, user_id)
+
+    if request.method == 'GET':
+        args = filter_args(request, FEATURE)
+        count, last_id, last_modified = feature_service.get_features_validator(project_id)
+        reply = conditional(request, (count, last_id, last_modified), last_modified)
+        if reply.status == 304:
+            return reply
+        if wants_stream(request):
+            reply.stream = Stream(
+                'features', FeatureService, 'features', args['fields'], project_id, filters=args['filters'], sort=args['sort']
+            )
+            return reply
+        features, next_cursor = feature_service.get_features(project_id, **args)
+        reply.body = {'features': FEATURE.dump_rows(features, args['fields']), 'next_cursor': next_cursor}
+        return reply
+
+    f = feature_service.create_feature(data, project_id)
+    return Reply({'feature': FEATURE.dump(f)}, 201)
+
+def project_tasks(db, user_id, request, data, project_id) -> Reply:
+    task_service = TaskService(db, user_id)
+    args = filter_args(request, TASK)
+    count, last_id, last_modified = task_service.get_project_tasks_validator(project_id)
+    reply = conditional(request, (count, last_id, last_modified), last_modified)
+    if reply.status == 304:
+        return reply
+    if wants_stream(request):
+        reply.stream = Stream(
+            'tasks', TaskService, 'project_tasks', args['fields'], project_id, filters=args['filters'], sort=args['sort']
+        )
+        return reply
+    tasks, next_cursor = task_service.get_project_tasks(project_id, **args)
+    reply.body = {'tasks': TASK.dump_rows(tasks, args['fields']), 'next_cursor': next_cursor}
+    return reply
+
+def feature(db, user_id, request, data, feature_id) -> Reply:
+    feature_service = FeatureService(db, user_id)
+
+    if request.method == 'GET':
+        f = feature_service.get_feature(feature_id)
+        reply = conditional(request, (f.id, f.updated_at), f.updated_at)
+        if reply.status == 304:
+            return reply
+        reply.body = {'feature': FEATURE.dump(f)}
+        return reply
+    elif request.method == 'PATCH':
+        f = feature_service.update_feature(feature_id, data)
+        return Reply({"feature": FEATURE.dump(f)})
+
+    feature_service.delete_feature(feature_id)
+    return Reply({"feature_deleted": feature_id})
+
+def tasks(db, user_id, request, data, feature_id) -> Reply:
+    task_service = TaskService(db, user_id)
+
+    if request.method == 'GET':
+        args = filter_args(request, TASK)
+        count, last_id, last_modified = task_service.get_tasks_validator(feature_id)
+        reply = conditional(request, (count, last_id, last_modified), last_modified)
+        if reply.status == 304:
+            return reply
+        if wants_stream(request):
+            reply.stream = Stream('tasks', TaskService, 'tasks', args['fields'], feature_id, filters=args['filters'], sort=args['sort'])
+            return reply
+        tasks, next_cursor = task_service.get_tasks(feature_id, **args)
+        reply.body = {'tasks': TASK.dump_rows(tasks, args['fields']), 'next_cursor': next_cursor}
+        return reply
+
+    t = task_service.create_task(data, feature_id)
+    return Reply({'task': TASK.dump(t)}, 201)
+
+def tasks_batch_create(db, user_id, request, data, feature_id) -> Reply:
+    task_ids = TaskService(db, user_id).create_tasks(data.get('tasks'), feature_id)
+    return Reply({'task_ids': task_ids}, 201)
+
+def tasks_batch(db, user_id, request, data) -> Reply:
+    task_service = TaskService(db, user_id)
+
+    if request.method == 'PATCH':
+        return Reply({'tasks_updated': task_service.update_tasks(data.get('tasks'))})
+    return Reply({'tasks_deleted': task_service.delete_tasks(data.get('ids'))})
+
+def task(db, user_id, request, data, task_id) -> Reply:
+    task_service = TaskService(db, user_id)
+
+    if request.method == 'GET':
+        t = task_service.get_task(task_id)
+        reply = conditional(request, (t.id, t.updated_at), t.updated_at)
+        if reply.status == 304:
+            return reply
+        reply.body = {'task': TASK.dump(t)}
+        return reply
+    elif request.method == 'PATCH':
+        t = task_service.update_task(task_id, data)
+        return Reply({'task': TASK.dump(t)})
+
+    task_service.delete_task(task_id)
+    return Reply({"task_deleted": task_id})
+
+def notes(db, user_id, request, data, task_id) -> Reply:
+    note_service = NoteService(db, user_id)
+
+    if request.method == 'GET':
+        args = list_args(request, NOTE)
+        count, last_id, last_modified = note_service.get_notes_validator(task_id)
+        reply = conditional(request, (count, last_id, last_modified), last_modified)
+        if reply.status == 304:
+            return reply
+        if wants_stream(request):
+            reply.stream = Stream('notes', NoteService, 'notes', args['fields'], task_id)
+            return reply
+        notes, next_cursor = note_service.get_notes(task_id, **args)
+        reply.body = {'notes': NOTE.dump_rows(notes, args['fields']), 'next_cursor': next_cursor}
+        return reply
+
+    n = note_service.create_note(data, task_id)
+    return Reply({'note': NOTE.dump(n)}, 201)
+
+def notes_batch_create(db, user_id, request, data, task_id) -> Reply:
+    note_ids = NoteService(db, user_id).create_notes(data.get('notes'), task_id)
+    return Reply({'note_ids': note_ids}, 201)
+
+def notes_batch(db, user_id, request, data) -> Reply:
+    note_service = NoteService(db, user_id)
+
+    if request.method == 'PATCH':
+        return Reply({'notes_updated': note_service.update_notes(data.get('notes'))})
+    return Reply({'notes_deleted': note_service.delete_notes(data.get('ids'))})
+
+def note(db, user_id, request, data, note_id) -> Reply:
+    note_service = NoteService(db, user_id)
+
+    if request.method == 'GET':
+        n = note_service.get_note(note_id)
+        reply = conditional(request, (n.id, n.updated_at), n.updated_at)
+        if reply.status == 304:
+            return reply
+        reply.body = {'note': NOTE.dump(n)}
+        return reply
+    elif request.method == 'PATCH':
+        n = note_service.update_note(note_id, data)
+        return Reply({'note': NOTE.dump(n)})
+
+    note_service.delete_note(note_id)
+    return Reply({"note_deleted": note_id})
+
+def project_export(db, user_id, request, data, project_id) -> Reply:
+    #the job result holds the document, in the shape POST /projects:import takes
+    ProjectService(db, user_id).get_project(project_id)
+    return enqueue_job(db, user_id, 'export_project', {'project_id': project_id})
+
+def project_import(db, user_id, request, data) -> Reply:
+    if not isinstance(data, dict) or not isinstance(data.get('project'), dict):
+        raise ValueError("Project document not found")
+    return enqueue_job(db, user_id, 'import_project', {'project': data['project']})
+
+def recompute_progress(db, user_id, request, data) -> Reply:
+    return enqueue_job(db, user_id, 'recompute_progress')
+
+def jobs(db, user_id, request, data) -> Reply:
+    args = list_args(request, JOB)
+    jobs, next_cursor = JobService(db, user_id).get_jobs(**args)
+    return Reply({"jobs": JOB.dump_rows(jobs, args['fields']), "next_cursor": next_cursor})
+
+def job(db, user_id, request, data, job_id) -> Reply:
+    return Reply({"job": JOB.dump(JobService(db, user_id).get_job(job_id))})
+
+def search(db, user_id, request, data) -> Reply:
+    results, next_cursor = SearchService(db, user_id).search(
+        request.args.get('q'),
+        after=request.args.get('after', type=int),
+        limit=request.args.get('limit', type=int)
+    )
+    return Reply({'results': results, 'next_cursor': next_cursor})
+
+#The change feed waits between reads, which each app does its own way (a thread waiting on the notifier, or a
+#coroutine sleeping). The reads and the reply are shared
+
+def read_changes(db, user_id, since, limit=None):
+    return ChangeService(db, user_id).get_changes(since, limit)
+
+def latest_cursor(db, user_id):
+    return ChangeService(db, user_id).latest_cursor()
+
+def changes_reply(changes, cursor) -> Reply:
+    return Reply({'changes': CHANGE.dump_rows(changes), 'cursor': cursor})
@@ -0,0 +1,96 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_app_context
+from sqlalchemy import event
+import config
+
+logger = logging.getLogger("projectflow.db")
+_local = threading.local()
+
+
+class QueryStats:
+    #query count, total time and the slowest statements of one request (or one assert_max_queries block)
+    __slots__ = ('count', 'total_ms', 'slowest')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest = []
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if len(self.slowest) < config.SLOWEST_QUERIES_KEPT or elapsed_ms > self.slowest[-1][0]:
+            self.slowest.append((elapsed_ms, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[config.SLOWEST_QUERIES_KEPT:]
+
+
+def install(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    #kept on the execution context, so a statement that fails leaves nothing behind for the next one
+    context._query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._query_start) * 1000
+    if elapsed_ms >= config.SLOW_QUERY_MS:
+        logger.warning(json.dumps({"event": "slow_query", "ms": round(elapsed_ms, 2), "statement": statement[:1000]}))
+
+    stats = g.get('query_stats') if has_app_context() else None
+    if stats is not None:
+        stats.record(statement, elapsed_ms)
+    for counter in getattr(_local, 'counters', ()):
+        counter.record(statement, elapsed_ms)
+
+
+def init_app(app):
+    if not config.INSTRUMENTATION_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_stats():
+        g.query_stats = QueryStats()
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def report_request_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.total_ms:.2f};desc="{stats.count} queries", app;dur={total_ms:.2f}'
+        )
+        logger.info(json.dumps({
+            "event": "request",
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": stats.count,
+            "db_ms": round(stats.total_ms, 2),
+            "total_ms": round(total_ms, 2),
+            "slowest": [{"ms": round(ms, 2), "statement": statement[:200]} for ms, statement in stats.slowest]
+        }))
+        return response
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    #test helper: fails when the wrapped block (e.g. one test client request) issues more than limit queries
+    counter = QueryStats()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+    if counter.count > limit:
+        statements = "\n".join(statement for _, statement in counter.slowest)
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}. Slowest:\n{statements}")
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+import config
+from db import LocalSession
+from metrics import job_counters, job_timings
+from services.base import BatchValidationError
+from services.jobs import JobService, jobs_queued
+from services.project import ProjectService
+
+#Background jobs. Requests queue a row in the jobs table and return 202, worker threads in every server process
+#(or in `flask --app app run-jobs`) claim due rows, run the handler of the job's kind and store its result or error.
+#Each handler runs as the job's user with its own session, and what it writes commits together with the job's result.
+
+def purge_project(db, user_id, payload):
+    #commits after each chunk of tasks, so a retried job continues where the failed attempt stopped
+    project_service = ProjectService(db, user_id)
+    deleted = 0
+    while True:
+        chunk = project_service.delete_project_tasks(payload['project_id'], config.DELETE_CHUNK_SIZE)
+        if not chunk:
+            break
+        db.commit()
+        deleted += chunk
+    project_service.delete_project(payload['project_id'])
+    return {'project_deleted': payload['project_id'], 'tasks_deleted': deleted}
+
+def export_project(db, user_id, payload):
+    return {'project': ProjectService(db, user_id).export_project(payload['project_id'])}
+
+def import_project(db, user_id, payload):
+    project = ProjectService(db, user_id).import_project(payload['project'])
+    return {'project_id': project.id}
+
+def recompute_progress(db, user_id, payload):
+    ProjectService(db, user_id).recompute_progress()
+    return None
+
+JOB_HANDLERS = {
+    'purge_project': purge_project,
+    'export_project': export_project,
+    'import_project': import_project,
+    'recompute_progress': recompute_progress,
+}
+
+
+class JobQueue:
+    '''
+    Worker threads that run queued jobs. Jobs are claimed through the database, so any number of processes can run
+    a queue on the same table. start() is idempotent and must be called after forking, see gunicorn.conf.py.
+    '''
+    def __init__(self, workers: int, poll_interval: float, sweep_interval: float = config.JOB_TIMEOUT_S):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        #the first idle poll of the process sweeps, then one per sweep_interval across all its threads
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        #lets running jobs finish, queued jobs stay in the table for the next start
+        with self._lock:
+            self._stopping.set()
+            jobs_queued.notify()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def join(self):
+        for thread in list(self._threads):
+            thread.join()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            seen = jobs_queued.generation()
+            try:
+                ran = self.run_next()
+            except Exception:
+                #e.g the database is unavailable, the worker keeps polling
+                logging.error("Job worker failed to claim a job", exc_info=True)
+                ran = False
+            if not ran:
+                jobs_queued.wait(seen, self.poll_interval)
+
+    def run_next(self) -> bool:
+        #runs one due job, returns False when there was none
+        db = LocalSession()
+        try:
+            job_service = JobService(db, None)
+            job = job_service.claim_job(config.JOB_USER_CONCURRENCY)
+            if job is None:
+                #an idle poll only reads, the write lock is left to request writers unless a sweep is due
+                if self._sweep_due():
+                    job_service.requeue_stale_jobs(config.JOB_TIMEOUT_S)
+                    db.commit()
+                return False
+            db.commit()
+            job_counters.increment('started')
+            job_timings.record('wait', (job.started_at - job.run_after).total_seconds() * 1000)
+
+            started = time.perf_counter()
+            try:
+                handler = JOB_HANDLERS.get(job.kind)
+                if handler is None:
+                    raise ValueError(f"Unknown job kind '{job.kind}'")
+                result = handler(db, job.user_id, job.payload or {})
+                job_service.finish_job(job, result)
+                db.commit()
+                job_counters.increment('succeeded')
+            except Exception as e:
+                db.rollback()
+                self._fail(job_service, job, e)
+                db.commit()
+            job_timings.record('run', (time.perf_counter() - started) * 1000)
+            return True
+        finally:
+            db.close()
+
+    def _sweep_due(self) -> bool:
+        with self._sweep_lock:
+            now = time.monotonic()
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + self.sweep_interval
+            return True
+
+    def _fail(self, job_service, job, error):
+        #invalid input (ValueError, e.g the project was deleted meanwhile) fails at once, anything else is retried
+        message = f"{error}: {error.errors}" if isinstance(error, BatchValidationError) else str(error)
+        if job_service.fail_job(job, message, retry=not isinstance(error, ValueError)):
+            job_counters.increment('retried')
+            logging.warning(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}, retrying: {message}")
+        elif isinstance(error, ValueError):
+            job_counters.increment('failed')
+            logging.warning(f"Job {job.id} ({job.kind}) rejected: {message}")
+        else:
+            job_counters.increment('failed')
+            logging.error(f"Job {job.id} ({job.kind}) failed: {message}", exc_info=error)
+
+
+job_queue = JobQueue(config.JOB_WORKERS, config.JOB_POLL_INTERVAL_S)
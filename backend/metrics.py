@@ -0,0 +1,43 @@
+import threading
+
+class Counters:
+    #thread-safe named counters for the process, read through the /metrics route
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def increment(self, name: str, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+db_counters = Counters('requests', 'sessions_opened', 'commits', 'rollbacks')
+
+class Timings:
+    #count, mean and max of named durations in milliseconds for the process, read through the /metrics route
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = {name: [0, 0.0, 0.0] for name in names}
+
+    def record(self, name: str, ms: float):
+        with self._lock:
+            values = self._values.setdefault(name, [0, 0.0, 0.0])
+            values[0] += 1
+            values[1] += ms
+            values[2] = max(values[2], ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {'count': count, 'avg_ms': round(total / count, 2) if count else 0, 'max_ms': round(peak, 2)}
+                for name, (count, total, peak) in self._values.items()
+            }
+
+
+job_counters = Counters('queued', 'started', 'succeeded', 'retried', 'failed')
+#wait: from due to claimed, run: from claimed to finished
+job_timings = Timings('wait', 'run')
@@ -0,0 +1,177 @@
+from sqlalchemy import MetaData, inspect, text, select, update, insert, func
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateTable
+from models import Base, Project, Feature, Task, Note, ChangeLog, ChangeLogState
+import search
+
+#Lightweight forward-only migrations for databases created by older versions of the models.
+#create_all only creates missing tables, so columns and indexes added to existing tables are applied here.
+
+def recompute_progress(connection):
+    from services.project import ProjectService
+    with Session(bind=connection) as db:
+        ProjectService(db, None).recompute_progress()
+        db.flush()
+
+def backfill_feature_owners(connection):
+    owner = select(Project.parent_userid).filter(Project.id == Feature.project_id).scalar_subquery()
+    connection.execute(update(Feature).values(owner_id=owner).where(Feature.owner_id.is_(None)))
+
+def backfill_task_owners(connection):
+    owner = select(Feature.owner_id).filter(Feature.id == Task.feature_id).scalar_subquery()
+    connection.execute(update(Task).values(owner_id=owner).where(Task.owner_id.is_(None)))
+
+def backfill_note_updated_at(connection):
+    connection.execute(update(Note).values(updated_at=Note.created_at))
+
+def backfill_note_owners(connection):
+    owner = select(Task.owner_id).filter(Task.id == Note.task_id).scalar_subquery()
+    connection.execute(update(Note).values(owner_id=owner).where(Note.owner_id.is_(None)))
+
+#data backfills that run once, in the same transaction, after a column is added
+BACKFILLS = {
+    ('features', 'total_points'): recompute_progress,
+    ('projects', 'total_points'): recompute_progress,
+    ('features', 'owner_id'): backfill_feature_owners,
+    ('tasks', 'owner_id'): backfill_task_owners,
+    ('work_notes', 'owner_id'): backfill_note_owners,
+    ('work_notes', 'updated_at'): backfill_note_updated_at,
+}
+
+#indexes of earlier versions that the models no longer define, dropped when present.
+#The (owner_id, id) indexes competed with the parent indexes on list queries that filter on both columns
+DROPPED_INDEXES = {
+    'features': ['ix_features_owner_id_id'],
+    'tasks': ['ix_tasks_owner_id_id'],
+    'work_notes': ['ix_work_notes_owner_id_id'],
+}
+
+
+def upgrade_database(engine):
+    with engine.begin() as connection:
+        _upgrade_columns(connection)
+    upgrade_foreign_keys(engine)
+    #after the foreign key upgrade, which drops the indexes and triggers of rebuilt SQLite tables
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for name in DROPPED_INDEXES.get(table.name, []):
+                if name in existing_indexes:
+                    connection.execute(text(f"DROP INDEX {name}"))
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+        search.install(connection)
+        seed_change_log_state(connection)
+
+def seed_change_log_state(connection):
+    #databases purged before the high-water mark was kept: entries below the oldest retained one are gone
+    if connection.scalar(select(ChangeLogState.id)) is None:
+        oldest = connection.scalar(select(func.min(ChangeLog.id)))
+        if oldest is not None and oldest > 1:
+            connection.execute(insert(ChangeLogState).values(id=1, purged_through=oldest - 1))
+
+def _upgrade_columns(connection):
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    backfills = []
+    not_null_columns = []
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            if connection.dialect.name == 'sqlite' and column.server_default is not None and not isinstance(column.server_default.arg, str):
+                #SQLite only adds columns with constant defaults, the backfill sets existing rows instead
+                column_ddl = f"{column.name} {column.type.compile(dialect=connection.dialect)}"
+            elif not column.nullable and column.server_default is None:
+                #existing rows have no value yet, the column is added nullable and tightened after its backfill
+                column_ddl = f"{column.name} {column.type.compile(dialect=connection.dialect)}"
+                not_null_columns.append((table.name, column.name))
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+            backfill = BACKFILLS.get((table.name, column.name))
+            if backfill and backfill not in backfills:
+                backfills.append(backfill)
+
+    for backfill in backfills:
+        backfill(connection)
+    #SQLite cannot alter column constraints in place, there the models keep enforcing the value
+    if connection.dialect.name != 'sqlite':
+        for table_name, column_name in not_null_columns:
+            connection.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL"))
+
+def upgrade_foreign_keys(engine):
+    #create_all leaves the foreign keys of existing tables as they were, e.g without the ON DELETE CASCADE
+    #that deletes now rely on
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        stale = {
+            table: foreign_keys for table in Base.metadata.sorted_tables if table.name in existing_tables
+            for foreign_keys in [_stale_foreign_keys(inspector, table)] if foreign_keys
+        }
+    if not stale:
+        return
+    if engine.dialect.name == 'sqlite':
+        _rebuild_sqlite_tables(engine, list(stale))
+    else:
+        with engine.begin() as connection:
+            for table, foreign_keys in stale.items():
+                for name, constraint in foreign_keys:
+                    columns = ", ".join(constraint.column_keys)
+                    referred_columns = ", ".join(element.column.name for element in constraint.elements)
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} DROP CONSTRAINT {name}, ADD CONSTRAINT {name} "
+                        f"FOREIGN KEY ({columns}) REFERENCES {constraint.referred_table.name} ({referred_columns}) "
+                        f"ON DELETE {constraint.ondelete}"
+                    ))
+
+def _stale_foreign_keys(inspector, table) -> list:
+    #(existing constraint name, model constraint) for each foreign key whose ON DELETE rule differs from the model
+    existing = {tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)}
+    stale = []
+    for constraint in table.foreign_key_constraints:
+        reflected = existing.get(tuple(constraint.column_keys))
+        if reflected is None:
+            continue
+        if (reflected.get('options', {}).get('ondelete') or '').upper() != (constraint.ondelete or '').upper():
+            stale.append((reflected['name'], constraint))
+    return stale
+
+def _rebuild_sqlite_tables(engine, tables):
+    #SQLite cannot alter a foreign key, so each table is copied into a new one created from the model and renamed back
+    #(https://www.sqlite.org/lang_altertable.html#otheralter). Enforcement is off meanwhile, or dropping a parent
+    #table would delete or reject its child rows. The indexes and triggers go with the old table and are recreated
+    #by upgrade_database. Columns the model no longer has are dropped.
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+
+    with engine.connect() as connection:
+        #the pragma has no effect inside a transaction, so it is managed explicitly here
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            connection.exec_driver_sql("BEGIN")
+            try:
+                for table in tables:
+                    new_table = table.to_metadata(metadata, name=f"_new_{table.name}")
+                    columns = ", ".join(column.name for column in table.columns)
+                    connection.execute(CreateTable(new_table))
+                    connection.exec_driver_sql(f"INSERT INTO {new_table.name} ({columns}) SELECT {columns} FROM {table.name}")
+                    connection.exec_driver_sql(f"DROP TABLE {table.name}")
+                    connection.exec_driver_sql(f"ALTER TABLE {new_table.name} RENAME TO {table.name}")
+                violations = connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+                if violations:
+                    raise RuntimeError(f"Foreign key violations after rebuilding tables: {violations[:10]}")
+                connection.exec_driver_sql("COMMIT")
+            except Exception:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+        finally:
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
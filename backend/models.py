@@ -1,14 +1,37 @@
 import math
 from typing import List
-from sqlalchemy import Column, DateTime, Text, String, Integer, ForeignKey, Boolean, CheckConstraint
+from sqlalchemy import Column, DateTime, Text, String, Integer, ForeignKey, Boolean, CheckConstraint, Index, JSON
 from sqlalchemy.orm import Mapped, DeclarativeBase, mapped_column, relationship
-from sqlalchemy.sql import func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import func, expression
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class utcnow(expression.FunctionElement):
+    #current timestamp for created_at and updated_at. SQLite's CURRENT_TIMESTAMP only has second resolution, which
+    #is too coarse for the ETag validators built from max(updated_at): a row replaced within the same second would
+    #leave the validator unchanged. Set as the insert default too, the server defaults stay for existing databases
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def calculate_progress(completed_points, total_points) -> int:
+    if not total_points:
+        return 0
+    return math.ceil((completed_points/total_points) * 100)
+
+
 class User(Base):
     __tablename__ = "user_accounts"
 
@@ -18,8 +41,17 @@ class User(Base):
     secret: Mapped[str] = mapped_column(String)
     project_list: Mapped[List["Project"]] = relationship(back_populates="owner", cascade="all, delete-orphan")
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow(), onupdate=utcnow())
+
+class UserSession(Base):
+    __tablename__ = "user_sessions"
+
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=True, index=True)
+    data: Mapped[str] = mapped_column(Text)
+    #unix timestamp, compared the same way on every backend
+    expires_at: Mapped[int] = mapped_column(Integer, index=True)
 
 class Project(Base):
     __tablename__ = "projects"
@@ -29,80 +61,77 @@ class Project(Base):
     description: Mapped[str] = mapped_column(Text, nullable=True)
     parent_userid: Mapped[int] = mapped_column(ForeignKey("user_accounts.id"))
     owner: Mapped["User"] = relationship(back_populates="project_list")
-    feature_list: Mapped[List["Feature"]] = relationship(back_populates="parent_project", cascade="all, delete-orphan")
+    #children are removed by ON DELETE CASCADE in the database, passive_deletes keeps the ORM from loading them first
+    feature_list: Mapped[List["Feature"]] = relationship(back_populates="parent_project", cascade="all, delete-orphan", passive_deletes=True)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow(), onupdate=utcnow())
     
+    #materialized rollups of task points, maintained by TaskService and FeatureService
+    completed_points: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    total_points: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    #composite indexes match the ownership filters, (foreign key, id) also serves keyset pagination
+    __table_args__ = (
+        Index("ix_projects_parent_userid_id", "parent_userid", "id"),
+        Index("ix_projects_parent_userid_updated_at_id", "parent_userid", "updated_at", "id"),
+    )
+
     @property
     def progress(self) -> int:
-        all_tasks = []
-        for feature in self.feature_list:
-            all_tasks.extend(feature.task_list)
-        
-        if not all_tasks:
-            return 0
-        
-        completed_points = 0
-        total_points = 0
-
-        for task in all_tasks:
-            if task.completed:
-                completed_points += task.points
-            total_points += task.points
-        if total_points == 0:
-            return 0
-        
-        return math.ceil((completed_points/total_points) * 100)
+        return calculate_progress(self.completed_points, self.total_points)
 
 class Feature(Base):
     __tablename__ = "features"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"))
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"))
+    #copied from the parent project at creation so authorization is a single-table predicate
+    owner_id: Mapped[int] = mapped_column(ForeignKey("user_accounts.id"))
     parent_project: Mapped["Project"] = relationship(back_populates="feature_list")
     name: Mapped[str] = mapped_column(String(255))
 
     description: Mapped[str] = mapped_column(Text, nullable=True)
-    task_list: Mapped[List["Task"]] = relationship(back_populates="parent_feature", cascade="all, delete-orphan")
+    task_list: Mapped[List["Task"]] = relationship(back_populates="parent_feature", cascade="all, delete-orphan", passive_deletes=True)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow(), onupdate=utcnow())
+
+    completed_points: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    total_points: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_features_project_id_id", "project_id", "id"),
+        Index("ix_features_project_id_updated_at_id", "project_id", "updated_at", "id"),
+    )
 
     @property
     def progress(self) -> int:
-        if not self.task_list:
-            return 0
-
-        completed_points = 0
-        total_points = 0
-
-        for task in self.task_list:
-            if task.completed:
-                completed_points += task.points
-            total_points += task.points
-        if total_points == 0:
-            return 0
-        return math.ceil((completed_points/total_points) * 100)
+        return calculate_progress(self.completed_points, self.total_points)
     
 class Task(Base):
     __tablename__ = "tasks"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    feature_id: Mapped[int] = mapped_column(ForeignKey('features.id'))
+    feature_id: Mapped[int] = mapped_column(ForeignKey('features.id', ondelete="CASCADE"))
+    owner_id: Mapped[int] = mapped_column(ForeignKey('user_accounts.id'))
     parent_feature: Mapped["Feature"] = relationship(back_populates="task_list")
     name: Mapped[str] = mapped_column(String(255))
 
     description: Mapped[str] = mapped_column(Text, nullable=True)
-    work_notes: Mapped[List["Note"]] = relationship(back_populates="parent_task", cascade="all, delete-orphan")
+    work_notes: Mapped[List["Note"]] = relationship(back_populates="parent_task", cascade="all, delete-orphan", passive_deletes=True)
     points: Mapped[int] = mapped_column(Integer, default=1)
     completed: Mapped[bool] = mapped_column(Boolean, default=False)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow(), onupdate=utcnow())
 
     __table_args__ = (
         CheckConstraint("points >= 1 AND points <= 10"),
+        Index("ix_tasks_feature_id_id", "feature_id", "id"),
+        #serves the filtered and sorted task lists, e.g open tasks by points
+        Index("ix_tasks_feature_id_completed_points_id", "feature_id", "completed", "points", "id"),
+        Index("ix_tasks_feature_id_updated_at_id", "feature_id", "updated_at", "id"),
     )
 
     @property
@@ -114,8 +143,70 @@ class Note(Base):
     __tablename__ = "work_notes"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    task_id: Mapped[int] = mapped_column(ForeignKey('tasks.id'))
+    task_id: Mapped[int] = mapped_column(ForeignKey('tasks.id', ondelete="CASCADE"))
+    owner_id: Mapped[int] = mapped_column(ForeignKey('user_accounts.id'))
     parent_task: Mapped["Task"] = relationship(back_populates="work_notes")
 
     content: Mapped[str] = mapped_column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow())
+    #the insert default also covers SQLite databases upgraded in place, which get the column without its server default
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=utcnow(), onupdate=utcnow())
+
+    __table_args__ = (
+        Index("ix_work_notes_task_id_id", "task_id", "id"),
+    )
+
+
+class ChangeLog(Base):
+    #append-only feed of the writes to each user's projects, features, tasks and notes. The id is the sync cursor,
+    #AUTOINCREMENT keeps ids from being reused on SQLite once old entries are purged
+    __tablename__ = "change_log"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer)
+    entity_type: Mapped[str] = mapped_column(String(16))
+    entity_id: Mapped[int] = mapped_column(Integer)
+    operation: Mapped[str] = mapped_column(String(8))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_change_log_user_id_id", "user_id", "id"),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class ChangeLogState(Base):
+    #a single row holding the highest change id purge_changes has removed. Cursors below it may have skipped purged
+    #entries; it survives a purge that empties the log, which min(id) does not
+    __tablename__ = "change_log_state"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    purged_through: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class Job(Base):
+    #Background work queued by a user. The table is the queue: workers of any process claim queued rows (see jobs.py).
+    #run_after, started_at and finished_at are naive UTC set by the application, so they compare the same on every backend
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_accounts.id"))
+    kind: Mapped[str] = mapped_column(String(32))
+    #queued, running, succeeded or failed
+    status: Mapped[str] = mapped_column(String(16), default='queued')
+    payload = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    run_after = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_after_id", "status", "run_after", "id"),
+        Index("ix_jobs_user_id_status", "user_id", "status"),
+        Index("ix_jobs_user_id_id", "user_id", "id"),
+    )
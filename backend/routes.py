@@ -0,0 +1,334 @@
+import logging
+import threading
+import time
+from flask import Blueprint, current_app, g, jsonify, request, session, Response, has_request_context, stream_with_context
+from db import LocalSession
+from auth import Authenticator
+from metrics import db_counters
+from services.user import UserService
+from services.changes import ChangesBusyError, change_notifier
+from web import (ERROR_STATUSES, error_response, wants_ndjson, set_validators, encode_rows, stream_mimetype, changes_args,
+    wants_event_stream, event_stream_start, change_event, KEEPALIVE_EVENT)
+import handlers
+import config
+
+api = Blueprint('api', __name__)
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+@api.before_app_request
+def count_request():
+    db_counters.increment('requests')
+
+def get_db():
+    #the session is opened on first use, so requests that never query never check out a connection
+    if 'db' not in g:
+        g.db = LocalSession()
+        #the request context is gone by the time close_session runs, so the method is noted here
+        g.db_read_only = has_request_context() and request.method in READ_ONLY_METHODS
+        db_counters.increment('sessions_opened')
+    return g.db
+
+def rollback_session():
+    #handled errors reach teardown without an exception, so error handlers discard pending writes here
+    db = g.get('db')
+    if db is not None and db.in_transaction():
+        db.rollback()
+        db_counters.increment('rollbacks')
+
+@api.after_app_request
+def commit_session(response):
+    #Writes commit before the session cookie is saved. The session store writes on its own connection, and on
+    #SQLite it would wait on the write lock this request still holds (e.g the password rehash on login)
+    db = g.get('db')
+    if db is not None and not g.get('db_read_only') and response.status_code < 400 and db.in_transaction():
+        db.commit()
+        db_counters.increment('commits')
+    return response
+
+#registered by create_app, runs when application context is popped (e.g after request context)
+def close_session(error):
+    db = g.pop('db', None)
+    if db is not None:
+        if error:
+            db.rollback()
+            db_counters.increment('rollbacks')
+        elif g.pop('db_read_only', False):
+            #nothing to persist on reads, close() releases the connection without a COMMIT round trip
+            pass
+        elif db.in_transaction():
+            db.commit()
+            db_counters.increment('commits')
+        db.close()
+
+def handle_error(e):
+    rollback_session()
+    body, status, headers = error_response(e)
+    return jsonify(body), status, headers
+
+for error in ERROR_STATUSES:
+    api.app_errorhandler(error)(handle_error)
+
+@api.app_errorhandler(Exception)
+def handle_general_error(e):
+    rollback_session()
+    logging.error(f"Unexpected error in {request.endpoint}: {str(e)}", exc_info=True)
+    return (
+        jsonify({"error": str(e)}),
+        500
+    )
+
+def json_body():
+    #reads never parse a body, a write without a JSON body gets None and fails validation in the service
+    if request.method in READ_ONLY_METHODS or not request.is_json:
+        return None
+    return request.get_json()
+
+def to_response(reply) -> Response:
+    if reply.stream is not None:
+        response = stream_rows(reply.stream)
+    elif reply.status == 304:
+        response = Response(status=304)
+    else:
+        response = jsonify(reply.body)
+        response.status_code = reply.status
+    response.headers.update(reply.headers)
+    if reply.session is not None:
+        session.clear()
+        session.regenerate()
+        session.update(reply.session)
+    return set_validators(response, reply.validators)
+
+def respond(handler, **view_args) -> Response:
+    return to_response(handler(get_db(), session['user_id'], request, json_body(), **view_args))
+
+def stream_rows(stream) -> Response:
+    #Writes the list incrementally instead of building it in memory. ?format=ndjson emits one object per line,
+    #otherwise the body is the usual {"<name>": [...]} document
+    ndjson = wants_ndjson(request)
+    service = stream.service_class(get_db(), session['user_id'])
+    rows = getattr(service, f"stream_{stream.list_name}")(*stream.parent_ids, stream.keys, **stream.options)
+
+    def generate():
+        if not ndjson:
+            yield f'{{"{stream.name}": ['
+        yield from encode_rows(current_app.json.dumps, rows, stream.keys, ndjson)
+        if not ndjson:
+            yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype=stream_mimetype(ndjson))
+
+@api.route("/")
+def home():
+    return handlers.HOME_PAGE
+
+@api.route("/metrics", methods=['GET'])
+def metrics():
+    return to_response(handlers.metrics(current_app.session_interface.cache))
+
+@api.route("/signup", methods=['POST'])
+def user_signup():
+    return to_response(handlers.signup(get_db(), request.get_json()))
+
+@api.route("/login", methods=['POST'])
+def user_login():
+    return to_response(handlers.login(get_db(), request.get_json()))
+
+@api.route("/logout", methods=['POST'])
+@Authenticator.authenticate_session
+def user_logout():
+    #clearing the session deletes it from the server-side store, revoking it everywhere
+    UserService.for_public(None).logout_user(session)
+    return jsonify({"message": "Logged out"}), 200
+
+@api.route("/users/<int:user_id>/change_password", methods=['PATCH'])
+@Authenticator.authenticate_session
+@Authenticator.check_authorization
+def change_user_password(user_id):
+    reply = handlers.change_password(get_db(), user_id, request.get_json())
+    session.regenerate()
+    return to_response(reply)
+
+@api.route("/users/<int:user_id>/change_email", methods=['PATCH'])
+@Authenticator.authenticate_session
+@Authenticator.check_authorization
+def change_user_email(user_id):
+    return to_response(handlers.change_email(get_db(), user_id, request.get_json()))
+
+@api.route("/projects", methods=['POST', 'GET'])
+@Authenticator.authenticate_session
+def handle_projects_route():
+    return respond(handlers.projects)
+
+@api.route("/projects/summary", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_projects_summary_route():
+    return respond(handlers.projects_summary)
+
+@api.route("/projects/<int:project_id>", methods=['GET', 'PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_project_route(project_id):
+    return respond(handlers.project, project_id=project_id)
+
+@api.route("/projects/<int:project_id>/tree", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_project_tree_route(project_id):
+    return respond(handlers.tree, project_id=project_id)
+
+@api.route("/projects/<int:project_id>/features", methods=['GET', 'POST'])
+@Authenticator.authenticate_session
+def handle_features_route(project_id):
+    return respond(handlers.features, project_id=project_id)
+
+@api.route("/projects/<int:project_id>/tasks", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_project_tasks_route(project_id):
+    return respond(handlers.project_tasks, project_id=project_id)
+
+@api.route("/features/<int:feature_id>", methods=['GET', 'PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_feature_route(feature_id):
+    return respond(handlers.feature, feature_id=feature_id)
+
+@api.route("/features/<int:feature_id>/tasks", methods=['GET', 'POST'])
+@Authenticator.authenticate_session
+def handle_tasks_route(feature_id):
+    return respond(handlers.tasks, feature_id=feature_id)
+
+@api.route("/features/<int:feature_id>/tasks:batch", methods=['POST'])
+@Authenticator.authenticate_session
+def handle_tasks_batch_create_route(feature_id):
+    return respond(handlers.tasks_batch_create, feature_id=feature_id)
+
+@api.route("/tasks:batch", methods=['PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_tasks_batch_route():
+    return respond(handlers.tasks_batch)
+
+@api.route("/tasks/<int:task_id>", methods=['GET', 'PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_task_route(task_id):
+    return respond(handlers.task, task_id=task_id)
+
+@api.route("/tasks/<int:task_id>/notes", methods=['GET', 'POST'])
+@Authenticator.authenticate_session
+def handle_notes_route(task_id):
+    return respond(handlers.notes, task_id=task_id)
+
+@api.route("/tasks/<int:task_id>/notes:batch", methods=['POST'])
+@Authenticator.authenticate_session
+def handle_notes_batch_create_route(task_id):
+    return respond(handlers.notes_batch_create, task_id=task_id)
+
+@api.route("/notes:batch", methods=['PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_notes_batch_route():
+    return respond(handlers.notes_batch)
+
+@api.route("/notes/<int:note_id>", methods=['GET', 'PATCH', 'DELETE'])
+@Authenticator.authenticate_session
+def handle_note_route(note_id):
+    return respond(handlers.note, note_id=note_id)
+
+@api.route("/projects/<int:project_id>:export", methods=['POST'])
+@Authenticator.authenticate_session
+def handle_project_export_route(project_id):
+    return respond(handlers.project_export, project_id=project_id)
+
+@api.route("/projects:import", methods=['POST'])
+@Authenticator.authenticate_session
+def handle_project_import_route():
+    return respond(handlers.project_import)
+
+@api.route("/projects:recompute-progress", methods=['POST'])
+@Authenticator.authenticate_session
+def handle_recompute_progress_route():
+    return respond(handlers.recompute_progress)
+
+@api.route("/jobs", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_jobs_route():
+    return respond(handlers.jobs)
+
+@api.route("/jobs/<int:job_id>", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_job_route(job_id):
+    return respond(handlers.job, job_id=job_id)
+
+@api.route("/search", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_search_route():
+    return respond(handlers.search)
+
+#slots for the requests of the change feed that wait, see CHANGES_MAX_WAITERS
+change_waiters = threading.BoundedSemaphore(config.CHANGES_MAX_WAITERS)
+
+def acquire_waiter():
+    if not change_waiters.acquire(blocking=False):
+        raise ChangesBusyError("Too many open change feeds, retry later or poll without wait")
+
+def read_changes(user_id, since, limit=None):
+    #a short-lived session per check, so waiting requests hold no connection or transaction
+    db = LocalSession()
+    try:
+        return handlers.read_changes(db, user_id, since, limit)
+    finally:
+        db.close()
+
+def read_latest_cursor(user_id):
+    #the starting cursor of a stream, read on its own session so g.db is not held for the life of the stream
+    db = LocalSession()
+    try:
+        return handlers.latest_cursor(db, user_id)
+    finally:
+        db.close()
+
+def stream_changes(user_id, since) -> Response:
+    #Server-sent events: one `change` event per entry with the change id as event id, so a reconnecting
+    #EventSource resumes from Last-Event-ID. Streams end after CHANGES_STREAM_MAX_S and the client reconnects.
+    def generate():
+        cursor = since
+        deadline = time.monotonic() + config.CHANGES_STREAM_MAX_S
+        yield event_stream_start()
+        while time.monotonic() < deadline:
+            changes, cursor = read_changes(user_id, cursor)
+            for change in changes:
+                yield change_event(current_app.json.dumps, change)
+            if not changes:
+                yield KEEPALIVE_EVENT
+                change_notifier.wait(config.CHANGES_POLL_INTERVAL_S)
+
+    acquire_waiter()
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    #released when the server closes the response, also if the client went away before the stream started
+    response.call_on_close(change_waiters.release)
+    return response
+
+@api.route("/changes", methods=['GET'])
+@Authenticator.authenticate_session
+def handle_changes_route():
+    #Delta sync. Without since the response only carries the current cursor, taken before loading data.
+    #wait=<seconds> long-polls until a change arrives; Accept: text/event-stream streams changes as they happen
+    user_id = session['user_id']
+    since, limit, wait = changes_args(request)
+
+    if wants_event_stream(request):
+        if since is None:
+            since = read_latest_cursor(user_id)
+        #an expired cursor fails here with 410, before the stream has started
+        read_changes(user_id, since, 1)
+        return stream_changes(user_id, since)
+
+    if since is None:
+        return to_response(handlers.changes_reply([], handlers.latest_cursor(get_db(), user_id)))
+    deadline = time.monotonic() + wait
+    changes, cursor = read_changes(user_id, since, limit)
+    if not changes and wait:
+        acquire_waiter()
+        try:
+            while not changes and time.monotonic() < deadline:
+                change_notifier.wait(min(config.CHANGES_POLL_INTERVAL_S, deadline - time.monotonic()))
+                changes, cursor = read_changes(user_id, since, limit)
+        finally:
+            change_waiters.release()
+    return to_response(handlers.changes_reply(changes, cursor))
@@ -0,0 +1,58 @@
+from sqlalchemy import text
+
+#Full-text index over the text columns of every searchable table, maintained by the database on each write.
+#SQLite uses one external-content FTS5 table per source kept in sync by triggers (no copy of the text),
+#PostgreSQL a GIN index over a tsvector expression that search queries repeat verbatim so the index is used.
+
+#(result type, table, indexed columns, owner column, title column)
+SEARCH_SOURCES = [
+    ('project', 'projects', ('name', 'description'), 'parent_userid', 'name'),
+    ('feature', 'features', ('name', 'description'), 'owner_id', 'name'),
+    ('task', 'tasks', ('name', 'description'), 'owner_id', 'name'),
+    ('note', 'work_notes', ('content',), 'owner_id', None),
+]
+TS_CONFIG = 'english'
+
+def fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+def tsvector(columns) -> str:
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    return f"to_tsvector('{TS_CONFIG}', {document})"
+
+def install(connection):
+    #idempotent, runs with the other schema upgrades
+    if connection.dialect.name == 'sqlite':
+        _install_fts5(connection)
+    elif connection.dialect.name == 'postgresql':
+        _install_tsvector(connection)
+
+def _install_fts5(connection):
+    existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")).scalars())
+    for _, table, columns, _, _ in SEARCH_SOURCES:
+        fts = fts_table(table)
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        if fts not in existing:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+            ))
+            #indexes the rows written before the table existed
+            connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+        insert_row = f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});"
+        delete_row = f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+        triggers = {
+            f"{fts}_ai": f"AFTER INSERT ON {table} BEGIN {insert_row} END",
+            f"{fts}_ad": f"AFTER DELETE ON {table} BEGIN {delete_row} END",
+            #only text changes touch the index, not e.g the progress counter updates
+            f"{fts}_au": f"AFTER UPDATE OF {column_list} ON {table} BEGIN {delete_row} {insert_row} END",
+        }
+        for name, body in triggers.items():
+            if name not in existing:
+                connection.execute(text(f"CREATE TRIGGER {name} {body}"))
+
+def _install_tsvector(connection):
+    for _, table, columns, _, _ in SEARCH_SOURCES:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin ({tsvector(columns)})"))
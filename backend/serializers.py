@@ -0,0 +1,70 @@
+import json
+from datetime import date, datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+from models import User, Project, Feature, Task, Note, ChangeLog, Job
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Serializer:
+    #One response shape per model. List endpoints select exactly these columns, so rows are column tuples
+    #in field order and can be zipped straight into dicts without touching ORM instrumentation.
+    def __init__(self, model, fields: list):
+        self.model = model
+        self.fields = fields
+
+    def keys(self, requested=None) -> list:
+        #id always comes first, it is the pagination cursor
+        if not requested:
+            return self.fields
+        unknown = [field for field in requested if field not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown field '{unknown[0]}'")
+        return ['id'] + [field for field in requested if field != 'id']
+
+    def dump(self, instance, keys=None) -> dict:
+        return {key: getattr(instance, key) for key in keys or self.fields}
+
+    def dump_rows(self, rows, keys=None) -> list:
+        keys = keys or self.fields
+        return [dict(zip(keys, row)) for row in rows]
+
+
+USER = Serializer(User, ['id', 'name', 'email'])
+PROJECT = Serializer(Project, ['id', 'name', 'description', 'created_at', 'updated_at'])
+FEATURE = Serializer(Feature, ['id', 'project_id', 'name', 'description', 'created_at', 'updated_at'])
+TASK = Serializer(Task, ['id', 'feature_id', 'name', 'description', 'points', 'completed', 'created_at', 'updated_at'])
+NOTE = Serializer(Note, ['id', 'task_id', 'content', 'created_at', 'updated_at'])
+CHANGE = Serializer(ChangeLog, ['id', 'entity_type', 'entity_id', 'operation', 'created_at'])
+JOB = Serializer(Job, ['id', 'kind', 'status', 'attempts', 'result', 'error', 'created_at', 'started_at', 'finished_at'])
+
+
+def _utc(value: datetime) -> datetime:
+    #the database stores UTC without an offset
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def _default(value):
+    if isinstance(value, datetime):
+        return _utc(value).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JSONProvider(DefaultJSONProvider):
+    #Uses orjson when it is installed and the standard library otherwise. Both write datetimes as ISO 8601 UTC.
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
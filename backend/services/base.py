@@ -1,6 +1,52 @@
-from sqlalchemy.orm import Query, Session
+import base64
+import json
+import operator
+from datetime import datetime, timezone
+from sqlalchemy import insert, update, delete, func, event, inspect, tuple_, type_coerce, literal, DateTime, String
+from sqlalchemy.orm import Query, Session, make_transient_to_detached
+from cache import build_entity_cache
+from models import ChangeLog
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+STREAM_BATCH_SIZE = 1000
+
+#list query parameter -> (column, comparison). A filter applies to every model that has the column
+LIST_FILTERS = {
+    'completed': ('completed', operator.eq),
+    'points_min': ('points', operator.ge),
+    'points_max': ('points', operator.le),
+    'created_after': ('created_at', operator.ge),
+    'created_before': ('created_at', operator.lt),
+    'updated_after': ('updated_at', operator.ge),
+    'updated_before': ('updated_at', operator.lt),
+}
+#tables whose writes are recorded in the change log, and the entity type clients see
+CHANGE_TYPES = {'projects': 'project', 'features': 'feature', 'tasks': 'task', 'work_notes': 'note'}
+#columns lists can be sorted by, prefixed with '-' for descending
+SORT_KEYS = ('id', 'points', 'created_at', 'updated_at')
+
+class BatchValidationError(ValueError):
+    #raised with every per-item error so the whole batch can be rejected before anything is written
+    def __init__(self, errors: list):
+        super().__init__("Batch rejected")
+        self.errors = errors
+
+entity_cache = build_entity_cache()
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_after_transaction(session):
+    #keys are dropped again once the transaction ends, in case a read re-cached the row in between
+    keys = session.info.pop('cache_invalidations', None)
+    if keys and entity_cache is not None:
+        for key in keys:
+            entity_cache.delete(key)
 
 class BaseService:
+    cache = entity_cache
+
     def __init__(self, db_session: Session, user_id):
         self.db = db_session
         self.user_id = user_id
@@ -11,16 +57,242 @@ class BaseService:
             raise ValueError("Entity not found")
         return entity
         
-    def _get_entities(self, query: Query):
-        entities = query.all()
-        return entities
+    def _get_cached_entity(self, model, _id, query: Query):
+        #Read-through cache keyed by (table, id, owner). Column values are cached rather than instances,
+        #a hit is rebuilt as a persistent instance and attached to the session without a SELECT.
+        if self.cache is None:
+            return self._get_entity(query)
+        key = (model.__tablename__, _id, self.user_id)
+        values = self.cache.get(key)
+        if values is not None:
+            instance = model(**values)
+            make_transient_to_detached(instance)
+            return self.db.merge(instance, load=False)
+
+        entity = self._get_entity(query)
+        self.cache.set(key, {attr.key: getattr(entity, attr.key) for attr in inspect(model).column_attrs})
+        return entity
+
+    def _get_entity_for_update(self, query: Query):
+        #Write paths compute counter deltas from the row they change, so they never read it from the entity cache.
+        #The row is reloaded over any instance already in the session and locked where the database supports it
+        return self._get_entity(query.populate_existing().with_for_update())
+
+    def _invalidate(self, model, ids):
+        if self.cache is None:
+            return
+        keys = [(model.__tablename__, _id, self.user_id) for _id in ids]
+        for key in keys:
+            self.cache.delete(key)
+        self.db.info.setdefault('cache_invalidations', set()).update(keys)
+
+    def _record_changes(self, model, ids, operation: str):
+        #written in the caller's transaction, so the log commits or rolls back with the change itself
+        entity_type = CHANGE_TYPES.get(model.__tablename__)
+        if entity_type is None or not ids:
+            return
+        rows = [{'user_id': self.user_id, 'entity_type': entity_type, 'entity_id': _id, 'operation': operation} for _id in ids]
+        self.db.execute(insert(ChangeLog), rows)
+        self.db.info['changes_recorded'] = True
+
+    def _get_entities(self, query: Query, model, after=None, limit=None, fields=None, filters=None, sort=None):
+        #Keyset pagination. Returns a page of entities (or column rows when fields are given) and the next cursor.
+        #The default order is the primary key and the cursor is the last id. Other sorts order by (column, id)
+        #and use an opaque cursor holding both, so pages stay stable without OFFSET.
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+        query = self._filter_entities(query, model, filters)
+        sort_key, descending = self._parse_sort(model, sort)
+        if fields:
+            query = query.with_entities(*self._select_columns(model, fields))
+
+        if sort_key == 'id':
+            if after is not None:
+                last_id = self._parse_id_cursor(after)
+                query = query.filter(model.id < last_id if descending else model.id > last_id)
+            entities = query.order_by(model.id.desc() if descending else model.id).limit(limit + 1).all()
+            next_cursor = None
+            if len(entities) > limit:
+                entities = entities[:limit]
+                next_cursor = entities[-1].id
+            return entities, next_cursor
+
+        sort_column = self._cursor_column(getattr(model, sort_key))
+        if after is not None:
+            value, last_id = self._decode_cursor(after, sort, sort_column)
+            position = tuple_(sort_column, model.id)
+            bound = tuple_(literal(value, sort_column.type), last_id)
+            query = query.filter(position < bound if descending else position > bound)
+        order = (sort_column.desc(), model.id.desc()) if descending else (sort_column, model.id)
+        rows = query.add_columns(sort_column.label('sort_value')).order_by(*order).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = self._encode_cursor(sort, last.sort_value, last[0].id if not fields else last.id)
+        #drops the sort value added for the cursor
+        return [row[0] if not fields else row[:-1] for row in rows], next_cursor
+
+    def _filter_entities(self, query: Query, model, filters):
+        #list filters compile to plain column predicates, which the composite list indexes serve
+        columns = model.__table__.columns
+        for name, value in (filters or {}).items():
+            if name not in LIST_FILTERS or LIST_FILTERS[name][0] not in columns:
+                raise ValueError(f"Unknown filter '{name}'")
+            column_name, compare = LIST_FILTERS[name]
+            column = getattr(model, column_name)
+            query = query.filter(compare(column, self._parse_value(column, value, name)))
+        return query
+
+    def _parse_sort(self, model, sort):
+        if not sort:
+            return 'id', False
+        descending = sort.startswith('-')
+        sort_key = sort.lstrip('-')
+        if sort_key not in SORT_KEYS or sort_key not in model.__table__.columns:
+            raise ValueError(f"Cannot sort by '{sort_key}'")
+        return sort_key, descending
+
+    def _parse_value(self, column, value, name):
+        try:
+            python_type = column.type.python_type
+            if python_type is bool:
+                if str(value).lower() not in ('1', 'true', '0', 'false'):
+                    raise ValueError
+                return str(value).lower() in ('1', 'true')
+            if python_type is datetime:
+                parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+                #timestamps are stored as naive UTC
+                return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+            return python_type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for '{name}'")
+
+    def _cursor_column(self, column):
+        #SQLite keeps timestamps as text written in more than one format, so pages are ordered and compared on the
+        #stored text there, the same order the index has. Other databases compare the typed values
+        if isinstance(column.type, DateTime) and self.db.get_bind().dialect.name == 'sqlite':
+            return type_coerce(column, String)
+        return column
+
+    def _parse_id_cursor(self, after):
+        try:
+            return int(after)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+
+    def _encode_cursor(self, sort, value, last_id) -> str:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        return base64.urlsafe_b64encode(json.dumps([sort, value, last_id]).encode()).decode()
+
+    def _decode_cursor(self, cursor, sort, sort_column):
+        try:
+            cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(str(cursor).encode()))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match the sort order")
+        if isinstance(sort_column.type, DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, last_id
+
+    def _get_validator(self, query: Query, model) -> tuple:
+        #count, max id and max updated_at of the rows a listing covers, in one aggregate query without loading rows
+        return tuple(query.with_entities(func.count(model.id), func.max(model.id), func.max(model.updated_at)).one())
+
+    def _stream_entities(self, query: Query, model, fields, filters=None, sort=None):
+        #yields column rows in list order, fetching STREAM_BATCH_SIZE rows at a time so memory stays flat
+        #the query is validated and executed here, only fetching is deferred to the consumer
+        query = self._filter_entities(query, model, filters)
+        sort_key, descending = self._parse_sort(model, sort)
+        query = query.with_entities(*self._select_columns(model, fields))
+        sort_column = self._cursor_column(getattr(model, sort_key))
+        order = (sort_column.desc(), model.id.desc()) if descending else (sort_column, model.id)
+        return (row for row in query.order_by(*order).yield_per(STREAM_BATCH_SIZE))
+
+    def _select_columns(self, model, fields):
+        columns = model.__table__.columns
+        selected = [model.id]
+        for field in fields:
+            if field not in columns:
+                raise ValueError(f"Unknown field '{field}'")
+            if field != 'id':
+                selected.append(getattr(model, field))
+        return selected
         
     def _create_entity(self, instance):
         self.db.add(instance)
         self.db.flush()
+        self._invalidate(type(instance), [instance.id])
+        self._record_changes(type(instance), [instance.id], 'insert')
         return instance
 
+    def _check_batch(self, items):
+        if not isinstance(items, list) or not items:
+            raise ValueError("Batch must be a non-empty list")
+        if len(items) > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size must not exceed {MAX_BATCH_SIZE}")
+
+    def _validate_batch(self, items, build_row):
+        #builds a row per item, collecting every item error instead of stopping at the first
+        self._check_batch(items)
+        rows, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Item must be an object")
+                rows.append(build_row(item))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        if errors:
+            raise BatchValidationError(errors)
+        return rows
+
+    def _check_batch_ids(self, ids: list, found):
+        errors = []
+        seen = set()
+        for index, _id in enumerate(ids):
+            if _id in seen:
+                errors.append({'index': index, 'error': "Duplicate id"})
+            elif _id not in found:
+                errors.append({'index': index, 'error': "Entity not found"})
+            seen.add(_id)
+        if errors:
+            raise BatchValidationError(errors)
+
+    @staticmethod
+    def _batch_id(item: dict):
+        if not isinstance(item.get('id'), int):
+            raise ValueError("Id is required")
+        return item['id']
+
+    def _create_entities(self, model, rows: list):
+        #single executemany INSERT, ids come back in parameter order
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        ids = self.db.scalars(stmt, rows).all()
+        self._record_changes(model, ids, 'insert')
+        return ids
+
+    def _update_entities(self, model, rows: list):
+        #executemany UPDATE keyed on the primary key in each row
+        if rows:
+            self.db.execute(update(model), rows)
+            self._invalidate(model, [row['id'] for row in rows])
+            self._record_changes(model, [row['id'] for row in rows], 'update')
+
+    def _delete_entities(self, model, ids: list):
+        if ids:
+            self.db.execute(delete(model).where(model.id.in_(ids)))
+            self._invalidate(model, ids)
+            self._record_changes(model, ids, 'delete')
+
     def _delete_entity(self, instance):  
+        #children removed by the cascade are not logged, a deleted parent implies them
+        self._invalidate(type(instance), [instance.id])
+        self._record_changes(type(instance), [instance.id], 'delete')
         self.db.delete(instance)
         self.db.flush()
         return
@@ -29,4 +301,6 @@ class BaseService:
         for field in allowed_fields:
             if data.get(field) is not None:
                 setattr(instance, field, data[field])
-        return instance
\ No newline at end of file
+        self._invalidate(type(instance), [instance.id])
+        self._record_changes(type(instance), [instance.id], 'update')
+        return instance
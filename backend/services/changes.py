@@ -0,0 +1,85 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, select, delete, func
+from sqlalchemy.orm import Session
+from models import ChangeLog, ChangeLogState
+from services.base import BaseService, MAX_PAGE_SIZE
+
+class ChangesExpiredError(Exception):
+    #the cursor is older than the retained log, the client has to reload its data and start from a new cursor
+    pass
+
+class ChangesBusyError(Exception):
+    #every slot for event streams and long polls of this worker is taken
+    pass
+
+class ChangeNotifier:
+    #Wakes waiting long polls and event streams of this process when a transaction that recorded changes commits.
+    #Changes committed by other workers are picked up by the periodic re-check instead.
+    def __init__(self):
+        self._condition = threading.Condition()
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, timeout: float):
+        with self._condition:
+            self._condition.wait(timeout)
+
+change_notifier = ChangeNotifier()
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session):
+    if session.info.pop('changes_recorded', False):
+        change_notifier.notify()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop('changes_recorded', None)
+
+class ChangeService(BaseService):
+    def get_changes(self, since: int, limit=None):
+        #Changes after the cursor in log order, and the cursor to continue from.
+        #On databases with concurrent writers a change can commit after a later id was read, clients should re-read
+        #a short overlap if they need every entry; SQLite serializes writers so ids commit in order there.
+        limit = MAX_PAGE_SIZE if limit is None else limit
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+        if since < 0:
+            raise ValueError("Cursor must not be negative")
+
+        #ids only grow, so a cursor below the purge high-water mark may have skipped purged changes
+        purged_through = self.db.scalar(select(ChangeLogState.purged_through).filter(ChangeLogState.id == 1))
+        if purged_through is not None and since < purged_through:
+            raise ChangesExpiredError("Cursor has expired, reload and use a new cursor")
+
+        changes = self.db.execute(
+            select(ChangeLog.id, ChangeLog.entity_type, ChangeLog.entity_id, ChangeLog.operation, ChangeLog.created_at)
+            .filter(ChangeLog.user_id == self.user_id, ChangeLog.id > since)
+            .order_by(ChangeLog.id)
+            .limit(limit)
+        ).all()
+        return changes, changes[-1].id if changes else since
+
+    def latest_cursor(self) -> int:
+        #the cursor a client takes after loading its data, later changes are newer than it. With an emptied log it is
+        #the purge mark, so the cursor is not taken for an expired one
+        purged_through = select(ChangeLogState.purged_through).filter(ChangeLogState.id == 1).scalar_subquery()
+        return self.db.scalar(select(func.coalesce(func.max(ChangeLog.id), purged_through, 0)))
+
+    def purge_changes(self, retention_days: int) -> int:
+        #removes entries of every user older than the retention period
+        #Entries up to the newest expired id go, so what is retained is exactly the ids above the recorded mark
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+        through = self.db.scalar(select(func.max(ChangeLog.id)).filter(ChangeLog.created_at < cutoff))
+        if through is None:
+            return 0
+        purged = self.db.execute(delete(ChangeLog).where(ChangeLog.id <= through)).rowcount
+        state = self.db.get(ChangeLogState, 1)
+        if state is None:
+            self.db.add(ChangeLogState(id=1, purged_through=through))
+        else:
+            state.purged_through = max(state.purged_through, through)
+        self.db.flush()
+        return purged
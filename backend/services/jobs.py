@@ -0,0 +1,139 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, select, update, func
+from sqlalchemy.orm import Session, aliased
+from models import Job
+from services.base import BaseService
+import config
+
+class JobLimitError(Exception):
+    #the user already has JOB_USER_MAX_PENDING jobs queued or running
+    pass
+
+class JobSignal:
+    #Wakes the idle workers of this process before their next poll when a transaction that queued jobs commits.
+    #Workers note the generation before looking for a job, so a signal sent while they were busy is not lost
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    def generation(self) -> int:
+        with self._condition:
+            return self._generation
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, seen: int, timeout: float):
+        with self._condition:
+            if self._generation == seen:
+                self._condition.wait(timeout)
+
+jobs_queued = JobSignal()
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session):
+    if session.info.pop('jobs_queued', False):
+        jobs_queued.notify()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop('jobs_queued', None)
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class JobService(BaseService):
+    def enqueue_job(self, kind: str, payload=None, max_attempts=None):
+        #the job is written in the caller's transaction and becomes visible to workers when it commits
+        pending = self.db.scalar(
+            select(func.count(Job.id)).filter(Job.user_id == self.user_id, Job.status.in_(('queued', 'running')))
+        )
+        if pending >= config.JOB_USER_MAX_PENDING:
+            raise JobLimitError(f"At most {config.JOB_USER_MAX_PENDING} jobs can be pending, retry when one has finished")
+
+        job = Job(
+            user_id=self.user_id,
+            kind=kind,
+            payload=payload,
+            max_attempts=max_attempts or config.JOB_MAX_ATTEMPTS,
+            run_after=_now()
+        )
+        self.db.add(job)
+        self.db.flush()
+        self.db.info['jobs_queued'] = True
+        return job
+
+    def get_job(self, _id: int):
+        query = self.db.query(Job).filter(Job.id == _id, Job.user_id == self.user_id)
+        return self._get_entity(query)
+
+    def get_jobs(self, after=None, limit=None, fields=None):
+        query = self.db.query(Job).filter(Job.user_id == self.user_id)
+        return self._get_entities(query, Job, after, limit, fields)
+
+    #the methods below are used by the workers with a service that has no user_id
+
+    def claim_job(self, user_concurrency: int):
+        #Marks the next due job running and returns it, or None. The conditional UPDATE is the claim, so workers
+        #in other processes never run the same job. The per-user limit is checked in the same statement; that is exact
+        #on SQLite, where writers are serialized, and can be exceeded briefly under concurrent claims on PostgreSQL
+        now = _now()
+        candidates = self.db.scalars(
+            select(Job.id).filter(Job.status == 'queued', Job.run_after <= now).order_by(Job.run_after, Job.id).limit(10)
+        ).all()
+        running = aliased(Job)
+        running_count = (
+            select(func.count(running.id))
+            .filter(running.user_id == Job.user_id, running.status == 'running')
+            .scalar_subquery()
+        )
+        for _id in candidates:
+            claimed = self.db.execute(
+                update(Job)
+                .where(Job.id == _id, Job.status == 'queued', running_count < user_concurrency)
+                .values(status='running', attempts=Job.attempts + 1, started_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                return self.db.get(Job, _id, populate_existing=True)
+        return None
+
+    def finish_job(self, job, result):
+        job.status = 'succeeded'
+        job.result = result
+        job.error = None
+        job.finished_at = _now()
+        self.db.flush()
+
+    def fail_job(self, job, error: str, retry: bool) -> bool:
+        #queues the job again after a backoff while it has attempts left, returns whether it will be retried
+        job.error = error
+        if retry and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = _now() + timedelta(seconds=config.JOB_RETRY_DELAY_S * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+            job.finished_at = _now()
+        self.db.flush()
+        return job.status == 'queued'
+
+    def requeue_stale_jobs(self, timeout_s: int) -> int:
+        #jobs whose worker process died while running them. The lost attempt counts, so a job that keeps
+        #taking its worker down fails once it is out of attempts
+        now = _now()
+        stale = (Job.status == 'running', Job.started_at < now - timedelta(seconds=timeout_s))
+        self.db.execute(
+            update(Job)
+            .where(*stale, Job.attempts >= Job.max_attempts)
+            .values(status='failed', error="Job did not finish within the timeout", finished_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        return self.db.execute(
+            update(Job)
+            .where(*stale)
+            .values(status='queued', run_after=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
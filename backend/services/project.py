@@ -1,5 +1,10 @@
-from models import Project, Feature, Task, Note
-from base import BaseService
+from collections import defaultdict
+from sqlalchemy import select, func, case, delete
+from sqlalchemy.orm import selectinload
+from models import Project, Feature, Task, Note, calculate_progress
+from services.base import BaseService, MAX_BATCH_SIZE
+
+TASK_FIELDS = ['name', 'description', 'points', 'completed']
 
 class ProjectService(BaseService):
     def create_project(self, data: dict):
@@ -14,99 +19,507 @@ class ProjectService(BaseService):
         return self._create_entity(project)
     
     def get_project(self, _id: int):
-        query = self.db.query(Project).filter(Project.id == _id, Project.parent_userid == self.user_id)
-        return self._get_entity(query)
+        return self._get_cached_entity(Project, _id, self._project_query(_id))
+
+    def _project_query(self, _id: int):
+        return self.db.query(Project).filter(Project.id == _id, Project.parent_userid == self.user_id)
+
+    def get_project_tree(self, _id: int, include_note_counts=False):
+        #project, features and tasks load in three queries via selectinload, note counts in one grouped query
+        query = (
+            self.db.query(Project)
+            .options(selectinload(Project.feature_list).selectinload(Feature.task_list))
+            .filter(Project.id == _id, Project.parent_userid == self.user_id)
+        )
+        project = self._get_entity(query)
+
+        note_counts = {}
+        if include_note_counts:
+            rows = (
+                self.db.query(Note.task_id, func.count(Note.id))
+                .join(Task).join(Feature)
+                .filter(Feature.project_id == project.id)
+                .group_by(Note.task_id)
+            )
+            note_counts = dict(rows.all())
+        return project, note_counts
+
+    def get_projects(self, after=None, limit=None, fields=None, filters=None, sort=None):
+        query = self.db.query(Project).filter(Project.parent_userid == self.user_id)
+        return self._get_entities(query, Project, after, limit, fields, filters, sort)
+
+    def get_projects_validator(self):
+        query = self.db.query(Project).filter(Project.parent_userid == self.user_id)
+        return self._get_validator(query, Project)
 
-    def get_projects(self):
+    def stream_projects(self, fields, filters=None, sort=None):
         query = self.db.query(Project).filter(Project.parent_userid == self.user_id)
-        return self._get_entities(query)
+        return self._stream_entities(query, Project, fields, filters, sort)
     
+    def get_progress_summary(self):
+        #one grouped aggregate over projects -> features -> tasks, rolled up per project in python
+        completed_case = case((Task.completed == True, 1), else_=0)
+        completed_points_case = case((Task.completed == True, Task.points), else_=0)
+        rows = self.db.execute(
+            select(
+                Project.id, Project.name, Feature.id.label('feature_id'), Feature.name.label('feature_name'),
+                func.count(Task.id).label('task_count'),
+                func.coalesce(func.sum(completed_case), 0).label('completed_count'),
+                func.coalesce(func.sum(Task.points), 0).label('total_points'),
+                func.coalesce(func.sum(completed_points_case), 0).label('completed_points')
+            )
+            .select_from(Project)
+            .outerjoin(Feature, Feature.project_id == Project.id)
+            .outerjoin(Task, Task.feature_id == Feature.id)
+            .filter(Project.parent_userid == self.user_id)
+            .group_by(Project.id, Project.name, Feature.id, Feature.name)
+            .order_by(Project.id, Feature.id)
+        ).all()
+
+        summary = {}
+        for row in rows:
+            project = summary.setdefault(row.id, {
+                'id': row.id, 'name': row.name, 'task_count': 0, 'completed_count': 0,
+                'total_points': 0, 'completed_points': 0, 'features': []
+            })
+            if row.feature_id is None:
+                continue
+            project['features'].append({
+                'id': row.feature_id, 'name': row.feature_name, 'task_count': row.task_count, 'completed_count': row.completed_count,
+                'total_points': row.total_points, 'completed_points': row.completed_points,
+                'progress': calculate_progress(row.completed_points, row.total_points)
+            })
+            for key in ('task_count', 'completed_count', 'total_points', 'completed_points'):
+                project[key] += getattr(row, key)
+
+        for project in summary.values():
+            project['progress'] = calculate_progress(project['completed_points'], project['total_points'])
+        return list(summary.values())
+
     def update_project(self, _id: int, data: dict):
-        project = self.get_project(_id)
+        project = self._get_entity_for_update(self._project_query(_id))
         return self._update_entity(project, data, ['name', 'description'])
 
     def delete_project(self, _id: int):
-        project = self.get_project(_id)
+        project = self._get_entity_for_update(self._project_query(_id))
+        if self.cache is not None:
+            #cached features and tasks go with the project
+            feature_ids = self.db.scalars(select(Feature.id).filter(Feature.project_id == _id)).all()
+            task_ids = self.db.scalars(select(Task.id).filter(Task.feature_id.in_(feature_ids))).all()
+            self._invalidate(Feature, feature_ids)
+            self._invalidate(Task, task_ids)
         return self._delete_entity(project)
+
+    def count_project_tasks(self, _id: int) -> int:
+        project = self.get_project(_id)
+        return self.db.scalar(select(func.count(Task.id)).join(Feature).filter(Feature.project_id == project.id))
+
+    def delete_project_tasks(self, _id: int, limit: int) -> int:
+        #Deletes up to limit tasks of the project (their notes cascade in the database) and returns how many.
+        #Lets a very large project be emptied in short transactions before delete_project, see jobs.purge_project.
+        #Each chunk keeps the point counters right in case the purge stops. Like a cascade, the deleted tasks are not
+        #logged, the chunk logs one project update and the final delete_project implies the rest
+        project = self._get_entity_for_update(self._project_query(_id))
+        rows = self.db.execute(
+            select(Task.id, Task.feature_id, Task.points, Task.completed).join(Feature)
+            .filter(Feature.project_id == project.id).order_by(Task.id).limit(min(limit, MAX_BATCH_SIZE))
+        ).all()
+        if not rows:
+            return 0
+
+        deltas = defaultdict(lambda: [0, 0])
+        for row in rows:
+            deltas[row.feature_id][0] += row.points if row.completed else 0
+            deltas[row.feature_id][1] += row.points
+        task_ids = [row.id for row in rows]
+        self.db.execute(delete(Task).where(Task.id.in_(task_ids)))
+        self._invalidate(Task, task_ids)
+        for feature_id, (completed, total) in deltas.items():
+            self.db.query(Feature).filter(Feature.id == feature_id).update({
+                Feature.completed_points: Feature.completed_points - completed,
+                Feature.total_points: Feature.total_points - total
+            })
+        self.db.query(Project).filter(Project.id == project.id).update({
+            Project.completed_points: Project.completed_points - sum(d[0] for d in deltas.values()),
+            Project.total_points: Project.total_points - sum(d[1] for d in deltas.values())
+        })
+        self._invalidate(Feature, list(deltas))
+        self._invalidate(Project, [project.id])
+        self._record_changes(Project, [project.id], 'update')
+        return len(rows)
+
+    def export_project(self, _id: int) -> dict:
+        #the project with its features, tasks and notes as a document for import_project, without ids or timestamps
+        project, _ = self.get_project_tree(_id)
+        notes = defaultdict(list)
+        rows = self.db.execute(
+            select(Note.task_id, Note.content).join(Task).join(Feature).filter(Feature.project_id == project.id).order_by(Note.id)
+        )
+        for task_id, content in rows:
+            notes[task_id].append(content)
+
+        return {
+            'name': project.name,
+            'description': project.description,
+            'features': [{
+                'name': feature.name,
+                'description': feature.description,
+                'tasks': [{
+                    'name': task.name,
+                    'description': task.description,
+                    'points': task.points,
+                    'completed': task.completed,
+                    'notes': notes[task.id]
+                } for task in sorted(feature.task_list, key=lambda task: task.id)]
+            } for feature in sorted(project.feature_list, key=lambda feature: feature.id)]
+        }
+
+    def import_project(self, document: dict):
+        #creates a project from an export_project document, entirely within the caller's transaction
+        if not isinstance(document, dict):
+            raise ValueError("Project document must be an object")
+        project = self.create_project(document)
+        feature_service = FeatureService(self.db, self.user_id)
+        task_service = TaskService(self.db, self.user_id)
+        note_service = NoteService(self.db, self.user_id)
+
+        for feature_data in document.get('features') or []:
+            if not isinstance(feature_data, dict):
+                raise ValueError("Feature must be an object")
+            feature = feature_service.create_feature(feature_data, project.id)
+            tasks = feature_data.get('tasks') or []
+            for start in range(0, len(tasks), MAX_BATCH_SIZE):
+                chunk = tasks[start:start + MAX_BATCH_SIZE]
+                task_ids = task_service.create_tasks(chunk, feature.id)
+                for task_id, task_data in zip(task_ids, chunk):
+                    if task_data.get('notes'):
+                        note_service.create_notes([{'content': content} for content in task_data['notes']], task_id)
+        return project
+
+    def recompute_progress(self):
+        #repairs the materialized point counters from the task rows. A service without a user_id repairs every project
+        feature_scope = Feature.project_id.in_(select(Project.id).filter(Project.parent_userid == self.user_id))
+        project_scope = Project.parent_userid == self.user_id
+        if self.user_id is None:
+            feature_scope = project_scope = True
+
+        feature_total = select(func.coalesce(func.sum(Task.points), 0)).filter(Task.feature_id == Feature.id).scalar_subquery()
+        feature_completed = (
+            select(func.coalesce(func.sum(Task.points), 0))
+            .filter(Task.feature_id == Feature.id, Task.completed == True)
+            .scalar_subquery()
+        )
+        self.db.query(Feature).filter(feature_scope).update(
+            {Feature.total_points: feature_total, Feature.completed_points: feature_completed, Feature.updated_at: Feature.updated_at},
+            synchronize_session=False
+        )
+
+        project_total = select(func.coalesce(func.sum(Feature.total_points), 0)).filter(Feature.project_id == Project.id).scalar_subquery()
+        project_completed = select(func.coalesce(func.sum(Feature.completed_points), 0)).filter(Feature.project_id == Project.id).scalar_subquery()
+        self.db.query(Project).filter(project_scope).update(
+            {Project.total_points: project_total, Project.completed_points: project_completed, Project.updated_at: Project.updated_at},
+            synchronize_session=False
+        )
+        self.db.expire_all()
+        if self.cache is not None:
+            self.cache.clear()
     
 class FeatureService(BaseService):
     def create_feature(self, data: dict, project_id):
         if not data.get('name'):
             raise ValueError("Name is required")
         
+        project_query = self.db.query(Project.id).filter(Project.id == project_id, Project.parent_userid == self.user_id)
+        self._get_entity(project_query)
+
         feature = Feature(
             name=data['name'],
             project_id=project_id,
+            owner_id=self.user_id,
             description=data.get('description'),
         )
         return self._create_entity(feature)
     
     def get_feature(self, _id: int):
-        query = self.db.query(Feature).join(Project).filter(Feature.id == _id, Project.parent_userid == self.user_id)
-        return self._get_entity(query)
+        return self._get_cached_entity(Feature, _id, self._feature_query(_id))
+
+    def _feature_query(self, _id: int):
+        return self.db.query(Feature).filter(Feature.id == _id, Feature.owner_id == self.user_id)
     
-    def get_features(self, project_id):
-        query = self.db.query(Feature).join(Project).filter(Project.id == project_id, Project.parent_userid == self.user_id)
-        return self._get_entities(query)
+    def get_features(self, project_id, after=None, limit=None, fields=None, filters=None, sort=None):
+        query = self.db.query(Feature).filter(Feature.project_id == project_id, Feature.owner_id == self.user_id)
+        return self._get_entities(query, Feature, after, limit, fields, filters, sort)
+
+    def get_features_validator(self, project_id):
+        query = self.db.query(Feature).filter(Feature.project_id == project_id, Feature.owner_id == self.user_id)
+        return self._get_validator(query, Feature)
+
+    def stream_features(self, project_id, fields, filters=None, sort=None):
+        query = self.db.query(Feature).filter(Feature.project_id == project_id, Feature.owner_id == self.user_id)
+        return self._stream_entities(query, Feature, fields, filters, sort)
     
     def update_feature(self, _id: int, data: dict):
-        feature = self.get_feature(_id)
+        feature = self._get_entity_for_update(self._feature_query(_id))
         return self._update_entity(feature, data, ['name', 'description'])
 
     def delete_feature(self, _id: int):
-        feature = self.get_feature(_id)
+        #the feature's own counters are subtracted from the project, so they are read from the database
+        feature = self._get_entity_for_update(self._feature_query(_id))
+        self.db.query(Project).filter(Project.id == feature.project_id).update({
+            Project.completed_points: Project.completed_points - feature.completed_points,
+            Project.total_points: Project.total_points - feature.total_points
+        })
+        self._invalidate(Project, [feature.project_id])
+        self._record_changes(Project, [feature.project_id], 'update')
+        if self.cache is not None:
+            self._invalidate(Task, self.db.scalars(select(Task.id).filter(Task.feature_id == _id)).all())
         return self._delete_entity(feature)
 
 class TaskService(BaseService):
     def create_task(self, data: dict, feature_id):
         if not data.get('name'):
             raise ValueError("Name is required")
+        #the point counters are adjusted from these values, so they are checked like the batch paths check them
+        self._validate_task_fields(data)
         
+        feature_query = self.db.query(Feature.id).filter(Feature.id == feature_id, Feature.owner_id == self.user_id)
+        self._get_entity(feature_query)
+
         task = Task(
             name=data['name'],
             feature_id=feature_id,
+            owner_id=self.user_id,
             description=data.get('description'),
             points=data.get('points'),
             completed=data.get('completed')
         )
-        return self._create_entity(task)
+        self._create_entity(task)
+        self._adjust_progress(task.feature_id, task.points if task.completed else 0, task.points)
+        return task
     
     def get_task(self, _id: int):
-        query = self.db.query(Task).join(Feature).join(Project).filter(Task.id == _id, Project.parent_userid == self.user_id)
-        return self._get_entity(query)
+        return self._get_cached_entity(Task, _id, self._task_query(_id))
+
+    def _task_query(self, _id: int):
+        return self.db.query(Task).filter(Task.id == _id, Task.owner_id == self.user_id)
     
-    def get_tasks(self, feature_id):
-        query = self.db.query(Task).join(Feature).join(Project).filter(Feature.id == feature_id, Project.parent_userid == self.user_id)
-        return self._get_entities(query)
+    def get_tasks(self, feature_id, after=None, limit=None, fields=None, filters=None, sort=None):
+        query = self.db.query(Task).filter(Task.feature_id == feature_id, Task.owner_id == self.user_id)
+        return self._get_entities(query, Task, after, limit, fields, filters, sort)
+
+    def get_tasks_validator(self, feature_id):
+        query = self.db.query(Task).filter(Task.feature_id == feature_id, Task.owner_id == self.user_id)
+        return self._get_validator(query, Task)
+
+    def stream_tasks(self, feature_id, fields, filters=None, sort=None):
+        query = self.db.query(Task).filter(Task.feature_id == feature_id, Task.owner_id == self.user_id)
+        return self._stream_entities(query, Task, fields, filters, sort)
+
+    def get_project_tasks(self, project_id, after=None, limit=None, fields=None, filters=None, sort=None):
+        #every task of the project in one query, the feature ids come from a subquery instead of a call per feature
+        return self._get_entities(self._project_tasks_query(project_id), Task, after, limit, fields, filters, sort)
+
+    def get_project_tasks_validator(self, project_id):
+        return self._get_validator(self._project_tasks_query(project_id), Task)
+
+    def stream_project_tasks(self, project_id, fields, filters=None, sort=None):
+        return self._stream_entities(self._project_tasks_query(project_id), Task, fields, filters, sort)
+
+    def _project_tasks_query(self, project_id):
+        feature_ids = select(Feature.id).filter(Feature.project_id == project_id, Feature.owner_id == self.user_id)
+        return self.db.query(Task).filter(Task.feature_id.in_(feature_ids), Task.owner_id == self.user_id)
     
     def update_task(self, _id: int, data: dict):
-        task = self.get_task(_id)
-        return self._update_entity(task, data, ['name', 'description', 'points', 'completed'])
+        self._validate_task_fields(data)
+        task = self._get_entity_for_update(self._task_query(_id))
+        old_completed, old_total = (task.points if task.completed else 0), task.points
+        self._update_entity(task, data, TASK_FIELDS)
+        self._adjust_progress(task.feature_id, (task.points if task.completed else 0) - old_completed, task.points - old_total)
+        return task
 
     def delete_task(self, _id: int):
-        task = self.get_task(_id)
+        task = self._get_entity_for_update(self._task_query(_id))
+        self._adjust_progress(task.feature_id, -(task.points if task.completed else 0), -task.points)
         return self._delete_entity(task)
 
+    def create_tasks(self, items: list, feature_id):
+        rows = self._validate_batch(items, self._new_task_row)
+        feature_query = self.db.query(Feature.id).filter(Feature.id == feature_id, Feature.owner_id == self.user_id)
+        self._get_entity(feature_query)
+
+        for row in rows:
+            row['feature_id'] = feature_id
+            row['owner_id'] = self.user_id
+        ids = self._create_entities(Task, rows)
+        self._adjust_progress(
+            feature_id,
+            sum(row['points'] for row in rows if row['completed']),
+            sum(row['points'] for row in rows)
+        )
+        return ids
+
+    def update_tasks(self, items: list):
+        rows = self._validate_batch(items, self._task_update_row)
+        ids = [row['id'] for row in rows]
+        tasks = self._get_owned_tasks(ids)
+        self._check_batch_ids(ids, tasks)
+
+        deltas = defaultdict(lambda: [0, 0])
+        for row in rows:
+            task = tasks[row['id']]
+            points, completed = row.get('points', task.points), row.get('completed', task.completed)
+            deltas[task.feature_id][0] += (points if completed else 0) - (task.points if task.completed else 0)
+            deltas[task.feature_id][1] += points - task.points
+
+        self._update_entities(Task, [row for row in rows if len(row) > 1])
+        for feature_id, (completed_delta, total_delta) in deltas.items():
+            self._adjust_progress(feature_id, completed_delta, total_delta)
+        return ids
+
+    def delete_tasks(self, ids: list):
+        self._check_batch(ids)
+        tasks = self._get_owned_tasks(ids)
+        self._check_batch_ids(ids, tasks)
+
+        deltas = defaultdict(lambda: [0, 0])
+        for task in tasks.values():
+            deltas[task.feature_id][0] -= task.points if task.completed else 0
+            deltas[task.feature_id][1] -= task.points
+
+        #notes are removed by ON DELETE CASCADE
+        self._delete_entities(Task, ids)
+        for feature_id, (completed_delta, total_delta) in deltas.items():
+            self._adjust_progress(feature_id, completed_delta, total_delta)
+        return ids
+
+    def _get_owned_tasks(self, ids: list) -> dict:
+        #authorizes every task of a batch in one query
+        rows = (
+            self.db.query(Task.id, Task.feature_id, Task.points, Task.completed)
+            .filter(Task.id.in_(ids), Task.owner_id == self.user_id)
+            .all()
+        )
+        return {row.id: row for row in rows}
+
+    def _new_task_row(self, data: dict) -> dict:
+        if not data.get('name'):
+            raise ValueError("Name is required")
+        self._validate_task_fields(data)
+        return {
+            'name': data['name'],
+            'description': data.get('description'),
+            'points': data.get('points') or 1,
+            'completed': bool(data.get('completed'))
+        }
+
+    def _task_update_row(self, data: dict) -> dict:
+        row = {'id': self._batch_id(data)}
+        self._validate_task_fields(data)
+        for field in TASK_FIELDS:
+            if data.get(field) is not None:
+                row[field] = data[field]
+        return row
+
+    @staticmethod
+    def _validate_task_fields(data: dict):
+        points = data.get('points')
+        if points is not None and (type(points) is not int or not 1 <= points <= 10):
+            raise ValueError("Points must be an integer between 1 and 10")
+        completed = data.get('completed')
+        if completed is not None and not isinstance(completed, bool):
+            raise ValueError("Completed must be true or false")
+
+    def _adjust_progress(self, feature_id, completed_delta: int, total_delta: int):
+        #keeps Feature/Project point counters in step with task writes using in-place UPDATEs, no rows are loaded
+        if not completed_delta and not total_delta:
+            return
+        project_id = self.db.query(Feature.project_id).filter(Feature.id == feature_id).scalar()
+        self.db.query(Feature).filter(Feature.id == feature_id).update({
+            Feature.completed_points: Feature.completed_points + completed_delta,
+            Feature.total_points: Feature.total_points + total_delta
+        })
+        self.db.query(Project).filter(Project.id == project_id).update({
+            Project.completed_points: Project.completed_points + completed_delta,
+            Project.total_points: Project.total_points + total_delta
+        })
+        self._invalidate(Feature, [feature_id])
+        self._invalidate(Project, [project_id])
+        #progress is part of both entities
+        self._record_changes(Feature, [feature_id], 'update')
+        self._record_changes(Project, [project_id], 'update')
+
 
 class NoteService(BaseService):
     def create_note(self, data: dict, task_id):
         if not data.get('content'):
             raise ValueError("Content is required")
         
-        task = Note(
+        task_query = self.db.query(Task.id).filter(Task.id == task_id, Task.owner_id == self.user_id)
+        self._get_entity(task_query)
+
+        note = Note(
             task_id=task_id,
+            owner_id=self.user_id,
             content=data['content']
         )
-        return self._create_entity(task)
+        return self._create_entity(note)
     
     def get_note(self, _id: int):
-        query = self.db.query(Note).join(Task).join(Feature).join(Project).filter(Note.id == _id, Project.parent_userid == self.user_id)
+        query = self.db.query(Note).filter(Note.id == _id, Note.owner_id == self.user_id)
         return self._get_entity(query)
     
-    def get_notes(self, task_id):
-        query = self.db.query(Note).join(Task).join(Feature).join(Project).filter(Task.id == task_id, Project.parent_userid == self.user_id)
-        return self._get_entities(query)
+    def get_notes(self, task_id, after=None, limit=None, fields=None):
+        query = self.db.query(Note).filter(Note.task_id == task_id, Note.owner_id == self.user_id)
+        return self._get_entities(query, Note, after, limit, fields)
+
+    def get_notes_validator(self, task_id):
+        query = self.db.query(Note).filter(Note.task_id == task_id, Note.owner_id == self.user_id)
+        return self._get_validator(query, Note)
+
+    def stream_notes(self, task_id, fields):
+        query = self.db.query(Note).filter(Note.task_id == task_id, Note.owner_id == self.user_id)
+        return self._stream_entities(query, Note, fields)
     
+    def create_notes(self, items: list, task_id):
+        rows = self._validate_batch(items, self._new_note_row)
+        task_query = self.db.query(Task.id).filter(Task.id == task_id, Task.owner_id == self.user_id)
+        self._get_entity(task_query)
+
+        for row in rows:
+            row['task_id'] = task_id
+            row['owner_id'] = self.user_id
+        return self._create_entities(Note, rows)
+
+    def update_notes(self, items: list):
+        rows = self._validate_batch(items, self._note_update_row)
+        ids = [row['id'] for row in rows]
+        self._check_batch_ids(ids, self._get_owned_note_ids(ids))
+        self._update_entities(Note, rows)
+        return ids
+
+    def delete_notes(self, ids: list):
+        self._check_batch(ids)
+        self._check_batch_ids(ids, self._get_owned_note_ids(ids))
+        self._delete_entities(Note, ids)
+        return ids
+
+    def _get_owned_note_ids(self, ids: list) -> set:
+        query = self.db.query(Note.id).filter(Note.id.in_(ids), Note.owner_id == self.user_id)
+        return {row.id for row in query}
+
+    @staticmethod
+    def _new_note_row(data: dict) -> dict:
+        if not data.get('content'):
+            raise ValueError("Content is required")
+        return {'content': data['content']}
+
+    def _note_update_row(self, data: dict) -> dict:
+        row = {'id': self._batch_id(data)}
+        if not data.get('content'):
+            raise ValueError("Content is required")
+        row['content'] = data['content']
+        return row
+
     def update_note(self, _id: int, data: dict):
         note = self.get_note(_id)
         return self._update_entity(note, data, ['content'])
@@ -0,0 +1,78 @@
+import re
+from sqlalchemy import text, bindparam
+from services.base import BaseService, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from search import SEARCH_SOURCES, TS_CONFIG, fts_table, tsvector
+
+class SearchService(BaseService):
+    def search(self, q, after=None, limit=None):
+        #Ranked full-text search over the user's projects, features, tasks and notes. Results are ordered by relevance,
+        #so the cursor is an offset into the ranking. Returns ({type, id, name, snippet} dicts, next_cursor)
+        terms = re.findall(r"\w+", q or "")
+        if not terms:
+            raise ValueError("Search query is required")
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+        offset = after or 0
+        if offset < 0:
+            raise ValueError("Cursor must not be negative")
+
+        sqlite = self.db.get_bind().dialect.name == 'sqlite'
+        #every term must match, the last one as a prefix so partially typed words find results
+        query = " ".join(f'"{term}"' for term in terms) + "*" if sqlite else " ".join(terms)
+
+        #phase one ranks ids only, phase two builds names and snippets for the returned page alone
+        ranked = self.db.execute(
+            text(self._ranking_sql(sqlite)),
+            {'query': query, 'user_id': self.user_id, 'limit': limit + 1, 'offset': offset}
+        ).all()
+        next_cursor = offset + limit if len(ranked) > limit else None
+        ranked = ranked[:limit]
+
+        details = {}
+        for kind, table, columns, _, title in SEARCH_SOURCES:
+            ids = [_id for row_kind, _id in ranked if row_kind == kind]
+            if ids:
+                statement = text(self._details_sql(sqlite, table, columns, title)).bindparams(bindparam('ids', expanding=True))
+                for _id, name, snippet in self.db.execute(statement, {'query': query, 'ids': ids}):
+                    details[(kind, _id)] = (name, snippet)
+
+        results = []
+        for kind, _id in ranked:
+            name, snippet = details[(kind, _id)]
+            results.append({'type': kind, 'id': _id, 'name': name, 'snippet': snippet})
+        return results, next_cursor
+
+    def _ranking_sql(self, sqlite: bool) -> str:
+        #bm25 is lower for better matches; ts_rank is negated so both sort ascending
+        selects = []
+        for kind, table, columns, owner, _ in SEARCH_SOURCES:
+            if sqlite:
+                fts = fts_table(table)
+                selects.append(
+                    f"SELECT '{kind}' AS kind, {fts}.rowid AS id, bm25({fts}) AS rank FROM {fts} "
+                    f"JOIN {table} ON {table}.id = {fts}.rowid WHERE {fts} MATCH :query AND {table}.{owner} = :user_id"
+                )
+            else:
+                selects.append(
+                    f"SELECT '{kind}' AS kind, id, -ts_rank({tsvector(columns)}, search_query) AS rank "
+                    f"FROM {table}, plainto_tsquery('{TS_CONFIG}', :query) AS search_query "
+                    f"WHERE {tsvector(columns)} @@ search_query AND {owner} = :user_id"
+                )
+        return (
+            "SELECT kind, id FROM (" + " UNION ALL ".join(selects) + ") AS matches "
+            "ORDER BY rank, kind, id LIMIT :limit OFFSET :offset"
+        )
+
+    def _details_sql(self, sqlite: bool, table, columns, title) -> str:
+        if sqlite:
+            fts = fts_table(table)
+            return (
+                f"SELECT rowid, {title or 'NULL'}, snippet({fts}, -1, '[', ']', '...', 12) FROM {fts} "
+                f"WHERE {fts} MATCH :query AND rowid IN :ids"
+            )
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+        return (
+            f"SELECT id, {title or 'NULL'}, ts_headline('{TS_CONFIG}', {document}, plainto_tsquery('{TS_CONFIG}', :query), "
+            f"'StartSel=[, StopSel=], MaxWords=12, MinWords=4') FROM {table} WHERE id IN :ids"
+        )
@@ -1,6 +1,7 @@
+from sqlalchemy.exc import IntegrityError
 from models import User
 from auth import Authenticator
-from base import BaseService
+from services.base import BaseService
 
 class UserService(BaseService):
     authenticator = Authenticator()
@@ -29,6 +30,10 @@ class UserService(BaseService):
         self.check_email(data['email']) 
         self.check_password(data['password'], data['confirm_password'])
 
+        #checked before hashing so a taken email does not cost a hash, the unique index still catches a concurrent signup
+        if self.db.query(User.id).filter(User.email == data['email']).first() is not None:
+            raise ValueError(f'User with email {data["email"]} already exists')
+
         secret = self.authenticator.hash_password(data['password'])
 
         user = User(
@@ -37,7 +42,11 @@ class UserService(BaseService):
             secret=secret
         )
 
-        return self._create_entity(user)
+        try:
+            return self._create_entity(user)
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(f'User with email {data["email"]} already exists')
     
     def get_user(self, _id=None, email=None) -> User:
         if not email and not _id:
@@ -49,17 +58,22 @@ class UserService(BaseService):
             query = self.db.query(User).filter(User.email == email)
             return self._get_entity(query)
         
-    def get_users(self):
+    def get_users(self, after=None, limit=None):
         query = self.db.query(User)
-        return self._get_entities(query)
+        return self._get_entities(query, User, after, limit)
     
     def change_user_email(self, _id, data):
         if not data.get('email'):
             raise ValueError('Email is required')
         self.check_email(data['email'])
 
-        user = self.get_user(_id=_id)
-        self._update_entity(user, data, ["email"])
+        try:
+            updated = self.db.query(User).filter(User.id == _id).update({User.email: data['email']})
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(f'User with email {data["email"]} already exists')
+        if not updated:
+            raise ValueError("Entity not found")
     
     def change_user_password(self, _id, data):
         if not data.get('password'):
@@ -69,14 +83,12 @@ class UserService(BaseService):
 
         self.check_password(data['password'], data['confirm_password'])
         secret = self.authenticator.hash_password(data['password'])
-        user = self.get_user(_id=_id)
-        return self._update_entity(user, {"secret": secret}, ['secret'])
+        if not self.db.query(User).filter(User.id == _id).update({User.secret: secret}):
+            raise ValueError("Entity not found")
         
     def check_email(self, email):
         if not Authenticator.email_validation(email):
             raise ValueError('Invalid email')
-        elif self.db.query(User).filter(User.email == email).first() is not None:
-            raise ValueError(f'User with email {email} already exists')
         else:
             return
     
@@ -94,14 +106,26 @@ class UserService(BaseService):
         if not data.get('password'):
             raise ValueError('Password is required')
         
-        user = self.get_user(email=data['email'])
+        #column-only fetch, the full ORM entity is never loaded
+        user = self.db.query(User.id, User.name, User.email, User.secret).filter(User.email == data['email']).first()
+        if user is None:
+            #unknown emails still pay for one verify so response time does not reveal which accounts exist
+            self.authenticator.dummy_verify(data['password'])
+            raise ValueError("Invalid credentials")
+
         authenticated = self.authenticator.authenticate_password(user.secret, data['password'])
         
         if not authenticated:
             raise ValueError("Invalid credentials")
+
+        #hashes made under older cost parameters are upgraded while the plaintext is available
+        if self.authenticator.needs_rehash(user.secret):
+            secret = self.authenticator.hash_password(data['password'])
+            self.db.query(User).filter(User.id == user.id).update({User.secret: secret})
         
         return user
 
     def logout_user(self, session):
         session.clear()
+        session.regenerate()
         return
\ No newline at end of file
@@ -0,0 +1,173 @@
+import json
+import secrets
+import threading
+import time
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from models import UserSession
+from cache import TTLCache
+import config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        #moves the session to a fresh id when the user's privileges change (login, logout, password change), so an id
+        #planted or leaked before that point does not carry over. The old id is deleted from the store on save
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SQLSessionStore:
+    #sessions live in the user_sessions table of the application database
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def load(self, sid):
+        with self.session_factory() as db:
+            row = db.get(UserSession, sid)
+            if row is None or row.expires_at < time.time():
+                return None
+            return json.loads(row.data)
+
+    def save(self, sid, data: dict, ttl: int):
+        with self.session_factory() as db:
+            db.merge(UserSession(id=sid, user_id=data.get('user_id'), data=json.dumps(data), expires_at=int(time.time()) + ttl))
+            db.commit()
+
+    def delete(self, sid):
+        with self.session_factory() as db:
+            db.query(UserSession).filter(UserSession.id == sid).delete()
+            db.commit()
+
+    def purge_expired(self) -> int:
+        with self.session_factory() as db:
+            deleted = db.query(UserSession).filter(UserSession.expires_at < time.time()).delete()
+            db.commit()
+            return deleted
+
+
+class RedisSessionStore:
+    #works with any client exposing the redis get/setex/delete commands, e.g. redis.Redis or LocalRedis
+    def __init__(self, client, prefix="session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        value = self.client.get(self.prefix + sid)
+        return None if value is None else json.loads(value)
+
+    def save(self, sid, data: dict, ttl: int):
+        self.client.setex(self.prefix + sid, ttl, json.dumps(data))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def purge_expired(self) -> int:
+        #redis expires keys itself
+        return 0
+
+
+class LocalRedis:
+    #in-process stand-in for the subset of redis commands the session store uses, for development and tests
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._values.get(key, (None, 0))
+            if value is not None and expires_at < time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def setex(self, key, ttl, value):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._values.pop(key, None) is not None for key in keys)
+
+
+def build_session_store(session_factory):
+    if config.SESSION_BACKEND == 'sql':
+        return SQLSessionStore(session_factory)
+    if config.SESSION_BACKEND == 'redis':
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package")
+        return RedisSessionStore(redis.Redis.from_url(config.REDIS_URL))
+    if config.SESSION_BACKEND == 'local':
+        return RedisSessionStore(LocalRedis())
+    raise RuntimeError(f"Unknown SESSION_BACKEND '{config.SESSION_BACKEND}'")
+
+
+class ServerSideSessionInterface(SessionInterface):
+    #The cookie only carries a random session id. Session contents are read through a per-worker LRU+TTL cache,
+    #so a revoked session stays usable on other workers for at most SESSION_CACHE_TTL_S seconds.
+    def __init__(self, store, cache: TTLCache = None):
+        self.store = store
+        self.cache = cache or TTLCache(config.SESSION_CACHE_SIZE, config.SESSION_CACHE_TTL_S)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+        data = self.cache.get(sid)
+        if data is None:
+            data = self.store.load(sid)
+            if data is None:
+                return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+            self.cache.set(sid, data)
+        return ServerSession(dict(data), sid=sid)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            self.cache.delete(session.previous_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                #a regenerated id was never stored, its old id was deleted above
+                if session.previous_sid is None:
+                    self.store.delete(session.sid)
+                    self.cache.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        data = dict(session)
+        self.store.save(session.sid, data, config.SESSION_TTL_S)
+        self.cache.set(session.sid, data)
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            max_age=config.SESSION_TTL_S,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path
+        )
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import pytest
+
+#settings are read when config is imported, so the test database and cheap hashing are set up before any app module loads
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ.setdefault("ARGON2_TIME_COST", "1")
+os.environ.setdefault("ARGON2_MEMORY_COST", "1024")
+os.environ.setdefault("ARGON2_PARALLELISM", "1")
+os.environ.setdefault("JOB_WORKERS", "0")
+#tests run in one process, where the local entity cache is safe and its invalidation is covered
+os.environ.setdefault("ENTITY_CACHE_BACKEND", "local")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete
+from db import create_database, engine
+from models import Base
+from services.base import entity_cache
+from app import create_app
+
+create_database()
+
+
+@pytest.fixture
+def app():
+    #every test starts from empty tables and caches
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(delete(table))
+    if entity_cache is not None:
+        entity_cache.clear()
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def client(app):
+    #a logged in user
+    client = app.test_client()
+    data = {'name': 'Test', 'email': 'test@example.com', 'password': 'password1', 'confirm_password': 'password1'}
+    assert client.post('/signup', json=data).status_code == 201
+    assert client.post('/login', json={'email': data['email'], 'password': data['password']}).status_code == 200
+    return client
+
+@pytest.fixture
+def project(client):
+    #one project with two features of three tasks each, every task has a note. Returns the ids
+    project_id = client.post('/projects', json={'name': 'Project'}).get_json()['new_project']['id']
+    feature_ids, task_ids = [], []
+    for name in ('One', 'Two'):
+        feature_id = client.post(f'/projects/{project_id}/features', json={'name': name}).get_json()['feature']['id']
+        tasks = [{'name': f'{name} {i}', 'points': i + 1, 'completed': i == 0} for i in range(3)]
+        ids = client.post(f'/features/{feature_id}/tasks:batch', json={'tasks': tasks}).get_json()['task_ids']
+        for task_id in ids:
+            client.post(f'/tasks/{task_id}/notes', json={'content': f'Note {task_id}'})
+        feature_ids.append(feature_id)
+        task_ids.extend(ids)
+    return {'project_id': project_id, 'feature_ids': feature_ids, 'task_ids': task_ids}
@@ -0,0 +1,69 @@
+import threading
+import time
+import pytest
+from auth import HashingPool, HashingUnavailableError
+
+def test_running_hash_holds_its_slot():
+    pool = HashingPool(workers=0, max_pending=0, timeout=0.05)
+    release = threading.Event()
+    first = threading.Thread(target=pool.run, args=(release.wait,))
+    first.start()
+    time.sleep(0.02)
+    #the single slot is held by the running hash, so a second call is refused
+    with pytest.raises(HashingUnavailableError):
+        pool.run(int)
+    release.set()
+    first.join()
+    assert pool.run(int) == 0
+
+def test_pool_timeout_does_not_free_the_slot():
+    pool = HashingPool(workers=1, max_pending=0, timeout=0.2)
+    with pytest.raises(HashingUnavailableError):
+        pool.run(time.sleep, 0.6)
+    #the timed out hash is still running in the pool process
+    with pytest.raises(HashingUnavailableError):
+        pool.run(int)
+    time.sleep(0.6)
+    assert pool.run(int) == 0
+
+def _hash_in_a_pool():
+    HashingPool(workers=1, max_pending=0, timeout=5).run(int)
+
+def test_pool_runs_in_daemonic_processes():
+    #e.g hypercorn's workers, which cannot start child processes
+    import multiprocessing
+    process = multiprocessing.Process(target=_hash_in_a_pool, daemon=True)
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+
+def test_duplicate_signup_is_rejected_before_hashing(client, monkeypatch):
+    from services.user import UserService
+    def hash_password(password):
+        raise AssertionError("duplicate email was hashed")
+    monkeypatch.setattr(UserService.authenticator, 'hash_password', hash_password)
+    data = {'name': 'Other', 'email': 'test@example.com', 'password': 'password2', 'confirm_password': 'password2'}
+    response = client.post('/signup', json=data)
+    assert response.status_code == 400
+    assert 'already exists' in response.get_json()['error']
+
+def test_saturated_pool_fails_fast():
+    pool = HashingPool(workers=0, max_pending=1, timeout=10, wait=0.05)
+    release = threading.Event()
+    first = threading.Thread(target=pool.run, args=(release.wait,))
+    first.start()
+    time.sleep(0.02)
+    #admitted, but no host-wide slot frees up, so the call gives up after `wait` rather than `timeout`
+    started = time.monotonic()
+    with pytest.raises(HashingUnavailableError):
+        pool.run(int)
+    assert time.monotonic() - started < 1
+    release.set()
+    first.join()
+
+def test_broken_pool_is_replaced():
+    import os
+    pool = HashingPool(workers=1, max_pending=0, timeout=5)
+    with pytest.raises(HashingUnavailableError):
+        pool.run(os._exit, 1)
+    assert pool.run(int) == 0
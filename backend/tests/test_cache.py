@@ -0,0 +1,35 @@
+from sqlalchemy import update
+from db import engine, LocalSession
+from models import Feature, Task
+
+def stale_points(task_id, points):
+    #another worker's write, which this worker's entity cache has not seen
+    with engine.begin() as connection:
+        task = connection.execute(Task.__table__.select().where(Task.id == task_id)).one()
+        connection.execute(update(Task).where(Task.id == task_id).values(points=points))
+        connection.execute(
+            update(Feature).where(Feature.id == task.feature_id).values(total_points=Feature.total_points + points - task.points)
+        )
+
+def feature_points(feature_id):
+    with LocalSession() as db:
+        feature = db.get(Feature, feature_id)
+        tasks = db.query(Task).filter(Task.feature_id == feature_id).all()
+        return feature.total_points, sum(task.points for task in tasks)
+
+def test_update_ignores_a_stale_cache_entry(client, project):
+    feature_id, task_id = project['feature_ids'][0], project['task_ids'][2]
+    assert client.get(f'/tasks/{task_id}').get_json()['task']['points'] == 3
+    stale_points(task_id, 7)
+    response = client.patch(f'/tasks/{task_id}', json={'name': 'Renamed'})
+    assert response.get_json()['task']['points'] == 7
+    total, expected = feature_points(feature_id)
+    assert total == expected
+
+def test_delete_ignores_a_stale_cache_entry(client, project):
+    feature_id, task_id = project['feature_ids'][0], project['task_ids'][2]
+    client.get(f'/tasks/{task_id}')
+    stale_points(task_id, 7)
+    assert client.delete(f'/tasks/{task_id}').status_code == 200
+    total, expected = feature_points(feature_id)
+    assert total == expected
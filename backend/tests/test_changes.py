@@ -0,0 +1,49 @@
+import threading
+import routes
+
+def test_feed_waiters_are_capped(client, project, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(routes, 'change_waiters', slots)
+    cursor = client.get('/changes').get_json()['cursor']
+    slots.acquire()
+    #no slot left: streams and waiting long polls are turned away, a poll that has changes to return is not
+    response = client.get('/changes', headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert client.get(f'/changes?since={cursor}&wait=5').status_code == 503
+    client.post('/projects', json={'name': 'Other'})
+    assert client.get(f'/changes?since={cursor}&wait=5').status_code == 200
+    slots.release()
+
+def test_stream_releases_its_slot_on_close(client, project, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(routes, 'change_waiters', slots)
+    response = client.get('/changes', headers={'Accept': 'text/event-stream'}, buffered=False)
+    assert response.status_code == 200
+    assert next(response.response).startswith(b'retry:')
+    assert not slots.acquire(blocking=False)
+    response.close()
+    assert slots.acquire(blocking=False)
+
+def test_stream_does_not_hold_the_request_session(client, project, monkeypatch):
+    opened = []
+    original = routes.get_db
+    monkeypatch.setattr(routes, 'get_db', lambda: opened.append(1) or original())
+    response = client.get('/changes', headers={'Accept': 'text/event-stream'}, buffered=False)
+    assert response.status_code == 200
+    assert not opened
+    response.close()
+
+def test_purged_cursor_expires_after_the_log_is_emptied(client, project):
+    from datetime import datetime
+    from db import LocalSession
+    from services.changes import ChangeService
+    cursor = client.get('/changes').get_json()['cursor']
+    client.post('/projects', json={'name': 'Other'})
+    with LocalSession() as db:
+        #a negative retention purges everything up to now
+        assert ChangeService(db, None).purge_changes(-1) > 0
+        db.commit()
+    assert client.get(f'/changes?since={cursor}').status_code == 410
+    latest = client.get('/changes').get_json()['cursor']
+    assert client.get(f'/changes?since={latest}').status_code == 200
@@ -0,0 +1,51 @@
+from db import LocalSession
+from models import ChangeLog, Feature, Project, Task
+from services.project import ProjectService
+
+def test_partial_purge_keeps_counters_and_change_log(client, project):
+    with LocalSession() as db:
+        user_id = db.get(Project, project['project_id']).parent_userid
+        cursor = db.query(ChangeLog.id).order_by(ChangeLog.id.desc()).limit(1).scalar()
+        #the purge job stopped after its first chunk
+        assert ProjectService(db, user_id).delete_project_tasks(project['project_id'], 4) == 4
+        db.commit()
+
+        for feature in db.query(Feature).filter(Feature.project_id == project['project_id']):
+            tasks = db.query(Task).filter(Task.feature_id == feature.id).all()
+            assert feature.total_points == sum(task.points for task in tasks)
+            assert feature.completed_points == sum(task.points for task in tasks if task.completed)
+        remaining = db.query(Task).join(Feature).filter(Feature.project_id == project['project_id']).all()
+        assert db.get(Project, project['project_id']).total_points == sum(task.points for task in remaining)
+
+        #the chunk is one project update in the feed, not a row per deleted task
+        logged = db.query(ChangeLog.entity_type, ChangeLog.entity_id, ChangeLog.operation).filter(ChangeLog.id > cursor).all()
+        assert [tuple(row) for row in logged] == [('project', project['project_id'], 'update')]
+
+def test_idle_polls_do_not_write(app, monkeypatch):
+    from sqlalchemy import event
+    from db import engine
+    from jobs import JobQueue
+    commits = []
+    listener = lambda connection: commits.append(connection)
+    event.listen(engine, "commit", listener)
+    try:
+        queue = JobQueue(workers=0, poll_interval=1, sweep_interval=60)
+        #the first idle poll sweeps stale jobs, the ones after it only read
+        assert not queue.run_next()
+        assert len(commits) == 1
+        for _ in range(3):
+            assert not queue.run_next()
+        assert len(commits) == 1
+    finally:
+        event.remove(engine, "commit", listener)
+
+def test_job_signal_is_not_lost_while_a_worker_is_busy():
+    import time
+    from services.jobs import JobSignal
+    signal = JobSignal()
+    seen = signal.generation()
+    #sent while the worker was looking for a job, the wait that follows returns at once
+    signal.notify()
+    started = time.monotonic()
+    signal.wait(seen, 5)
+    assert time.monotonic() - started < 1
@@ -0,0 +1,43 @@
+from instrumentation import assert_max_queries
+
+#Query counts of the read endpoints. Each test also grows the data and checks the count stays the same,
+#which is what an N+1 regression breaks. The session comes from the worker's session cache, so only the endpoint's
+#own queries are counted.
+
+def add_feature(client, project_id, tasks=3):
+    feature_id = client.post(f'/projects/{project_id}/features', json={'name': 'Extra'}).get_json()['feature']['id']
+    client.post(f'/features/{feature_id}/tasks:batch', json={'tasks': [{'name': f'Extra {i}'} for i in range(tasks)]})
+    return feature_id
+
+def count_queries(client, url, limit):
+    with assert_max_queries(limit) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return queries.count
+
+def test_project_tree_queries_do_not_grow_with_features(client, project):
+    url = f"/projects/{project['project_id']}/tree?notes=1"
+    before = count_queries(client, url, 4)
+    add_feature(client, project['project_id'])
+    add_feature(client, project['project_id'])
+    assert count_queries(client, url, 4) == before
+
+def test_progress_summary_queries_do_not_grow_with_projects(client, project):
+    before = count_queries(client, '/projects/summary', 1)
+    other = client.post('/projects', json={'name': 'Other'}).get_json()['new_project']['id']
+    add_feature(client, other)
+    add_feature(client, project['project_id'])
+    assert count_queries(client, '/projects/summary', 1) == before
+
+def test_list_queries_do_not_grow_with_rows(client, project):
+    feature_id = project['feature_ids'][0]
+    urls = [
+        '/projects',
+        f"/projects/{project['project_id']}/features",
+        f'/features/{feature_id}/tasks',
+        f"/projects/{project['project_id']}/tasks?sort=-points",
+    ]
+    before = [count_queries(client, url, 2) for url in urls]
+    client.post(f'/features/{feature_id}/tasks:batch', json={'tasks': [{'name': f'More {i}'} for i in range(20)]})
+    add_feature(client, project['project_id'])
+    assert [count_queries(client, url, 2) for url in urls] == before
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import event
+from db import engine
+
+#The list endpoints page with keyset queries that the composite indexes answer directly. These tests run
+#EXPLAIN QUERY PLAN on the page query a request issues and check SQLite searches the expected index instead of
+#scanning the table or sorting in a temporary b-tree.
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != 'sqlite', reason="plans are checked on SQLite")
+
+def page_query_plan(client, url):
+    statements = []
+    listener = lambda conn, cursor, statement, parameters, context, executemany: statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    pages = [(statement, parameters) for statement, parameters in statements if 'LIMIT' in statement and 'ORDER BY' in statement]
+    assert pages, f"no page query for {url}"
+    statement, parameters = pages[-1]
+    with engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+def assert_uses_index(plan, index):
+    assert any(f"INDEX {index} " in line for line in plan), plan
+    assert not any(line.startswith("SCAN") for line in plan), plan
+    assert not any("TEMP B-TREE" in line for line in plan), plan
+
+@pytest.mark.parametrize("url, index", [
+    ("/projects", "ix_projects_parent_userid_id"),
+    ("/projects?sort=updated_at", "ix_projects_parent_userid_updated_at_id"),
+    ("/projects/{project_id}/features", "ix_features_project_id_id"),
+    ("/projects/{project_id}/features?sort=-updated_at", "ix_features_project_id_updated_at_id"),
+    ("/features/{feature_id}/tasks", "ix_tasks_feature_id_id"),
+    ("/features/{feature_id}/tasks?completed=0&sort=-points", "ix_tasks_feature_id_completed_points_id"),
+    ("/features/{feature_id}/tasks?sort=updated_at", "ix_tasks_feature_id_updated_at_id"),
+    ("/tasks/{task_id}/notes", "ix_work_notes_task_id_id"),
+])
+def test_list_queries_search_composite_indexes(client, project, url, index):
+    url = url.format(project_id=project['project_id'], feature_id=project['feature_ids'][0], task_id=project['task_ids'][0])
+    assert_uses_index(page_query_plan(client, url), index)
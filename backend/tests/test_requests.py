@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+from db import engine
+
+#request lifecycle: reads close their session without a COMMIT, writes commit once
+
+@pytest.fixture
+def commits():
+    counted = []
+    listener = lambda connection: counted.append(1)
+    event.listen(engine, "commit", listener)
+    yield counted
+    event.remove(engine, "commit", listener)
+
+def test_reads_do_not_commit(client, project, commits):
+    for url in ('/projects', f"/projects/{project['project_id']}", f"/projects/{project['project_id']}/tree"):
+        assert client.get(url).status_code == 200
+    assert commits == []
+
+def test_reads_ignore_a_json_content_type(client, project):
+    #some clients send Content-Type: application/json on every request, reads never parse a body
+    response = client.get(f"/projects/{project['project_id']}", headers={'Content-Type': 'application/json'})
+    assert response.status_code == 200
+
+def test_writes_commit(client, project, commits):
+    assert client.patch(f"/projects/{project['project_id']}", json={'name': 'Renamed'}).status_code == 200
+    assert len(commits) == 1
+    assert client.get(f"/projects/{project['project_id']}").get_json()['project']['name'] == 'Renamed'
+
+def test_async_reads_do_not_commit(client, project):
+    asgi = pytest.importorskip("asgi")
+    counted = []
+    listener = lambda connection: counted.append(1)
+    event.listen(asgi.async_engine.sync_engine, "commit", listener)
+
+    async def run():
+        async with asgi.app.test_app() as test_app:
+            async_client = test_app.test_client()
+            await async_client.post('/login', json={'email': 'test@example.com', 'password': 'password1'})
+            counted.clear()
+            for _ in range(3):
+                response = await async_client.get(f"/projects/{project['project_id']}")
+                assert response.status_code == 200
+    try:
+        asyncio.run(run())
+    finally:
+        event.remove(asgi.async_engine.sync_engine, "commit", listener)
+    assert counted == []
+
+def test_async_write_fails_when_its_commit_fails(client, project, monkeypatch):
+    #as in the WSGI routes, writes commit in after_request, so a failed commit is answered with an error, not a 200
+    asgi = pytest.importorskip("asgi")
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async def failing_commit(self):
+        raise RuntimeError("commit failed")
+
+    async def run():
+        async with asgi.app.test_app() as test_app:
+            async_client = test_app.test_client()
+            await async_client.post('/login', json={'email': 'test@example.com', 'password': 'password1'})
+            monkeypatch.setattr(AsyncSession, 'commit', failing_commit)
+            response = await async_client.patch(f"/projects/{project['project_id']}", json={'name': 'Renamed'})
+            assert response.status_code == 500
+    asyncio.run(run())
+    assert client.get(f"/projects/{project['project_id']}").get_json()['project']['name'] == 'Project'
+
+def test_replacing_a_row_changes_the_etag(client, project):
+    #a task deleted and re-created within the same second keeps the count, and SQLite may reuse its id
+    feature_id, task_id = project['feature_ids'][1], project['task_ids'][-1]
+    etag = client.get(f'/features/{feature_id}/tasks').headers['ETag']
+    client.delete(f'/tasks/{task_id}')
+    client.post(f'/features/{feature_id}/tasks', json={'name': 'Two 2', 'points': 3})
+    assert client.get(f'/features/{feature_id}/tasks', headers={'If-None-Match': etag}).status_code == 200
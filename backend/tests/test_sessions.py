@@ -0,0 +1,61 @@
+from models import User, UserSession
+from db import LocalSession
+
+def session_id(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+def stored_ids():
+    with LocalSession() as db:
+        return {row.id for row in db.query(UserSession)}
+
+def test_login_issues_a_new_session_id(app):
+    client = app.test_client()
+    data = {'name': 'Test', 'email': 'test@example.com', 'password': 'password1', 'confirm_password': 'password1'}
+    client.post('/signup', json=data)
+    client.post('/login', json={'email': data['email'], 'password': data['password']})
+    first = session_id(client)
+    #logging in again on the same cookie replaces the id and removes the old one from the store
+    assert client.post('/login', json={'email': data['email'], 'password': data['password']}).status_code == 200
+    second = session_id(client)
+    assert second and second != first
+    assert stored_ids() == {second}
+
+def test_planted_session_id_is_not_reused(app):
+    client = app.test_client()
+    client.set_cookie('session', 'planted')
+    data = {'name': 'Test', 'email': 'test@example.com', 'password': 'password1', 'confirm_password': 'password1'}
+    client.post('/signup', json=data)
+    client.post('/login', json={'email': data['email'], 'password': data['password']})
+    assert session_id(client) != 'planted'
+
+def test_password_change_issues_a_new_session_id(client):
+    first = session_id(client)
+    with LocalSession() as db:
+        user_id = db.query(User.id).filter(User.email == 'test@example.com').scalar()
+    data = {'password': 'password2', 'confirm_password': 'password2'}
+    assert client.patch(f'/users/{user_id}/change_password', json=data).status_code == 200
+    second = session_id(client)
+    assert second != first
+    assert stored_ids() == {second}
+    assert client.get('/projects').status_code == 200
+
+def test_logout_deletes_the_session(client):
+    first = session_id(client)
+    assert client.post('/logout').status_code == 200
+    assert stored_ids() == set()
+    client.set_cookie('session', first)
+    assert client.get('/projects').status_code == 401
+
+def test_login_rehash_commits_before_the_session_is_saved(client, monkeypatch):
+    #the rehash UPDATE and the session row are written on different connections of the same SQLite database
+    from auth import Authenticator
+    from services.user import UserService
+    monkeypatch.setattr(UserService, 'authenticator', Authenticator(time_cost=2, memory_cost=1024, parallelism=1))
+    with LocalSession() as db:
+        old_secret = db.query(User.secret).filter(User.email == 'test@example.com').scalar()
+    response = client.post('/login', json={'email': 'test@example.com', 'password': 'password1'})
+    assert response.status_code == 200
+    with LocalSession() as db:
+        assert db.query(User.secret).filter(User.email == 'test@example.com').scalar() != old_secret
+    assert client.get('/projects').status_code == 200
@@ -0,0 +1,12 @@
+from db import LocalSession
+from models import Feature
+
+def test_single_task_writes_validate_points(client, project):
+    feature_id, task_id = project['feature_ids'][0], project['task_ids'][0]
+    with LocalSession() as db:
+        before = db.get(Feature, feature_id).total_points
+    assert client.patch(f'/tasks/{task_id}', json={'points': "3"}).status_code == 400
+    assert client.patch(f'/tasks/{task_id}', json={'completed': "yes"}).status_code == 400
+    assert client.post(f'/features/{feature_id}/tasks', json={'name': 'Bad', 'points': 11}).status_code == 400
+    with LocalSession() as db:
+        assert db.get(Feature, feature_id).total_points == before
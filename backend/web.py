@@ -0,0 +1,168 @@
+import hashlib
+from auth import AuthenticationError, AuthorizationError, HashingUnavailableError
+from services.base import BatchValidationError, LIST_FILTERS
+from services.changes import ChangesBusyError, ChangesExpiredError
+from services.jobs import JobLimitError
+from serializers import PROJECT, FEATURE, TASK, CHANGE
+import config
+
+#Request parsing and response building shared by the WSGI routes (routes.py) and the ASGI app (asgi.py).
+#Helpers take the framework's request object, Flask and Quart requests have the same args, path and header attributes.
+
+STREAM_CHUNK_ROWS = 500
+
+class Reply:
+    '''
+    What a shared handler (handlers.py) answers, turned into a Flask or Quart response by the app serving it.
+    body is the JSON document and None for a 304. validators are the (etag, last_modified) of a conditional GET,
+    stream a list the app writes incrementally instead of the body, session the values of a new login session.
+    '''
+    def __init__(self, body=None, status=200, headers=None, validators=None, stream=None, session=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.validators = validators
+        self.stream = stream
+        self.session = session
+
+class Stream:
+    '''
+    A list to stream: the document key, the service and its list, e.g 'tasks' for get_tasks and stream_tasks, the
+    columns, the parent ids and the filter options. The WSGI routes read stream_<list> on the request's session,
+    the ASGI app reads get_<list> page by page on a session of its own.
+    '''
+    def __init__(self, name, service_class, list_name, keys, *parent_ids, **options):
+        self.name = name
+        self.service_class = service_class
+        self.list_name = list_name
+        self.keys = keys
+        self.parent_ids = parent_ids
+        self.options = options
+
+#handled errors -> status. Looked up along the exception's MRO, so subclasses can map to their own status
+ERROR_STATUSES = {
+    ValueError: 400,
+    AuthenticationError: 401,
+    AuthorizationError: 403,
+    ChangesExpiredError: 410,
+    JobLimitError: 429,
+    HashingUnavailableError: 503,
+    ChangesBusyError: 503,
+}
+
+def error_response(e) -> tuple:
+    #(body, status, headers) of a handled error
+    status = next(ERROR_STATUSES[cls] for cls in type(e).__mro__ if cls in ERROR_STATUSES)
+    body = {"error": str(e)}
+    if isinstance(e, BatchValidationError):
+        body['errors'] = e.errors
+    headers = {}
+    if isinstance(e, HashingUnavailableError):
+        headers['Retry-After'] = "1"
+    elif isinstance(e, ChangesBusyError):
+        headers['Retry-After'] = str(int(config.CHANGES_POLL_INTERVAL_S) + 1)
+    elif isinstance(e, JobLimitError):
+        headers['Retry-After'] = str(int(config.JOB_POLL_INTERVAL_S) + 1)
+    return body, status, headers
+
+def list_args(request, serializer) -> dict:
+    #after is passed through as given, it is an id or an opaque cursor depending on the sort
+    fields = request.args.get('fields')
+    requested = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    return {
+        'after': request.args.get('after'),
+        'limit': request.args.get('limit', type=int),
+        'fields': serializer.keys(requested)
+    }
+
+def filter_args(request, serializer) -> dict:
+    #list_args plus the filters and sort of the project, feature and task lists
+    return {
+        **list_args(request, serializer),
+        'filters': {name: request.args[name] for name in LIST_FILTERS if name in request.args},
+        'sort': request.args.get('sort')
+    }
+
+def flag_arg(request, name) -> bool:
+    return request.args.get(name, default=False, type=lambda v: v.lower() in ('1', 'true'))
+
+def wants_stream(request) -> bool:
+    return wants_ndjson(request) or request.args.get('stream', '').lower() in ('1', 'true')
+
+def wants_ndjson(request) -> bool:
+    return request.args.get('format') == 'ndjson'
+
+def etag_for(request, validator) -> str:
+    #Conditional GET: the ETag hashes the request (path, pagination, fields) with a cheap validator of the data
+    return hashlib.sha1(f"{request.full_path}|{validator}".encode()).hexdigest()
+
+def conditional(request, validator, last_modified=None) -> Reply:
+    #Conditional GET: a 304 when the client already has the data, otherwise a reply carrying the validators that
+    #the handler fills in
+    etag = etag_for(request, validator)
+    if request.if_none_match.contains_weak(etag):
+        return Reply(status=304, validators=(etag, None))
+    return Reply(validators=(etag, last_modified))
+
+def set_validators(response, validators):
+    #validators are only sent with full responses and 304s, not with errors
+    if validators is not None and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+    return response
+
+def encode_rows(dumps, rows, keys, ndjson: bool, first=True):
+    #Yields list rows as text in chunks of STREAM_CHUNK_ROWS, to limit tiny writes. ndjson writes one object per line,
+    #otherwise rows are items of the JSON array the caller opened and first says whether one was written before
+    chunk = []
+    for row in rows:
+        encoded = dumps(dict(zip(keys, row)))
+        if ndjson:
+            chunk.append(encoded + '\n')
+        else:
+            chunk.append(encoded if first else ',' + encoded)
+        first = False
+        if len(chunk) >= STREAM_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def stream_mimetype(ndjson: bool) -> str:
+    return 'application/x-ndjson' if ndjson else 'application/json'
+
+def changes_args(request) -> tuple:
+    #(since, limit, wait) of GET /changes. since falls back to Last-Event-ID, so a reconnecting EventSource resumes
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    limit = request.args.get('limit', type=int)
+    wait = min(max(request.args.get('wait', default=0, type=float), 0), config.CHANGES_MAX_WAIT_S)
+    return since, limit, wait
+
+def wants_event_stream(request) -> bool:
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def event_stream_start() -> str:
+    return f"retry: {int(config.CHANGES_POLL_INTERVAL_S * 1000)}\n\n"
+
+def change_event(dumps, change) -> str:
+    #one server-sent `change` event, the change id is the event id
+    return f"id: {change.id}\nevent: change\ndata: {dumps(dict(zip(CHANGE.fields, change)))}\n\n"
+
+#comment line, keeps proxies from closing an idle stream
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+def project_tree(project, note_counts, include_notes: bool) -> dict:
+    features = []
+    for f in project.feature_list:
+        tasks = []
+        for t in f.task_list:
+            task = TASK.dump(t)
+            if include_notes:
+                task['note_count'] = note_counts.get(t.id, 0)
+            tasks.append(task)
+        features.append({**FEATURE.dump(f), "progress": f.progress, "tasks": tasks})
+    return {**PROJECT.dump(project), 'progress': project.progress, 'features': features}